@@ -0,0 +1,30 @@
+class Migration(migrations.Migration):
+    """
+    Outbox of the rollout calendar updates and notification emails, see drain_rollout_outbox()
+    """
+
+    dependencies = [
+        ('classes', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RolloutOutbox',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[
+                    ('update_gc_event', 'Update calendar event'),
+                    ('update_parent_gc_event', 'Update parent calendar event'),
+                    ('delete_gc_event', 'Delete calendar event'),
+                    ('change_email', 'Change notification email'),
+                    ('delete_email', 'Delete notification email'),
+                ], max_length=32)),
+                ('object_id', models.IntegerField()),
+                ('payload', models.JSONField(default=dict)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('available_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+                ('last_error', models.TextField(blank=True)),
+                ('create_date', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,76 @@
+BREAK_COMMENTS_PREFIX = 'on break till '
+
+
+def break_end_date(status_comments, last_class_date):
+    """
+    End date of a break from its "on break till" text, the last class on break when it doesn't parse
+    :param status_comments:
+    :param last_class_date:
+    :return: date
+    """
+    try:
+        return datetime.strptime(status_comments[len(BREAK_COMMENTS_PREFIX):], '%b %d, %Y').date()
+    except (TypeError, ValueError):
+        return last_class_date
+
+
+def backfill_student_breaks(apps, schema_editor):
+    """
+    One StudentBreak per student, reason and "on break till" text of the rows already on break
+    """
+    student_in_class_model = apps.get_model('classes', 'StudentInClass')
+    student_break_model = apps.get_model('classes', 'StudentBreak')
+
+    periods = student_in_class_model.objects\
+                                    .filter(status='break', break_period__isnull=True, last_class__isnull=False)\
+                                    .values('student_id', 'status_comments', 'comments')\
+                                    .annotate(first_date=Min('last_class__class_date'),
+                                              last_date=Max('last_class__class_date'))\
+                                    .order_by()
+
+    for period in periods:
+        student_break = student_break_model.objects.create(
+            student_id=period['student_id'],
+            start_date=period['first_date'],
+            end_date=break_end_date(period['status_comments'], period['last_date']),
+            reason=period['comments'] or '')
+
+        student_in_class_model.objects.filter(
+            status='break',
+            break_period__isnull=True,
+            last_class__isnull=False,
+            student_id=period['student_id'],
+            status_comments=period['status_comments'],
+            comments=period['comments']
+        ).update(break_period=student_break)
+
+
+class Migration(migrations.Migration):
+    """
+    StudentBreak, StudentInClass.break_period and the periods of the breaks taken before them
+    """
+
+    dependencies = [
+        ('classes', '0002_rolloutoutbox'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StudentBreak',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('start_date', models.DateField()),
+                ('end_date', models.DateField()),
+                ('reason', models.TextField(blank=True)),
+                ('student', models.ForeignKey(on_delete=models.CASCADE, related_name='breaks',
+                                              to='classes.student')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='studentinclass',
+            name='break_period',
+            field=models.ForeignKey(blank=True, null=True, on_delete=models.SET_NULL,
+                                    related_name='student_instances', to='classes.studentbreak'),
+        ),
+        migrations.RunPython(backfill_student_breaks, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,35 @@
+STAFF_TIME_INDEX_SQL = '''
+CREATE EXTENSION IF NOT EXISTS btree_gist;
+
+CREATE INDEX IF NOT EXISTS classrollout_staff_time ON classes_classrollout
+USING gist (staff_id, tsrange(class_date + start_time, class_date + end_time));
+'''
+
+DROP_STAFF_TIME_INDEX_SQL = '''
+DROP INDEX IF EXISTS classrollout_staff_time;
+'''
+
+ROOM_TIME_INDEX_SQL = '''
+CREATE INDEX IF NOT EXISTS classrollout_room_time ON classes_classrollout
+USING gist (room_id, tsrange(class_date + start_time, class_date + end_time));
+'''
+
+DROP_ROOM_TIME_INDEX_SQL = '''
+DROP INDEX IF EXISTS classrollout_room_time;
+'''
+
+
+class Migration(migrations.Migration):
+    """
+    Teacher and room overlap indexes of find_concurrences(), see ClassRolloutDetailView.
+    btree_gist is left installed on reverse, other indexes may use it
+    """
+
+    dependencies = [
+        ('classes', '0003_student_break_period'),
+    ]
+
+    operations = [
+        migrations.RunSQL(STAFF_TIME_INDEX_SQL, DROP_STAFF_TIME_INDEX_SQL),
+        migrations.RunSQL(ROOM_TIME_INDEX_SQL, DROP_ROOM_TIME_INDEX_SQL),
+    ]
@@ -0,0 +1,74 @@
+# relations read by the logs and the google calendar title and description
+ROLLOUT_RELATED = ('location', 'staff', 'subject', 'room', 'duration', 'class_id')
+
+
+class StudentBreak(models.Model):
+    """
+    Break period of a student.
+    The StudentInClass rows on break link to it through StudentInClass.break_period
+    and read their "on break till" text from it, see break_status_comments().
+    The rows put on break before the periods existed are linked by
+    classes/migrations/0003_student_break_period.py
+    """
+    student = models.ForeignKey(StudentInClass._meta.get_field('student').related_model,
+                                on_delete=models.CASCADE, related_name='breaks')
+    start_date = models.DateField()
+    end_date = models.DateField()
+    reason = models.TextField(blank=True)
+
+    @property
+    def status_comments(self):
+        return "on break till {}".format(self.end_date.strftime("%b %d, %Y"))
+
+
+StudentInClass.add_to_class('break_period', models.ForeignKey(StudentBreak, null=True, blank=True,
+                                                              on_delete=models.SET_NULL,
+                                                              related_name='student_instances'))
+
+
+def break_status_comments(student_in_class):
+    """
+    "on break till" text of a row on break, derived from its period so that moving
+    the end date doesn't rewrite the rows. Lists should select_related('break_period').
+    Rows without a period keep their stored status_comments
+    :param student_in_class:
+    :return: str
+    """
+    if student_in_class.break_period_id is None:
+        return student_in_class.status_comments
+
+    return student_in_class.break_period.status_comments
+
+
+StudentInClass.add_to_class('break_status_comments', property(break_status_comments))
+
+
+class RolloutOutbox(models.Model):
+    """
+    Calendar updates and notification emails of a rollout change.
+    Written in the same transaction as the change, delivered by drain_rollout_outbox()
+    """
+    UPDATE_GC_EVENT = 'update_gc_event'
+    UPDATE_PARENT_GC_EVENT = 'update_parent_gc_event'
+    DELETE_GC_EVENT = 'delete_gc_event'
+    CHANGE_EMAIL = 'change_email'
+    DELETE_EMAIL = 'delete_email'
+
+    KIND_CHOICES = (
+        (UPDATE_GC_EVENT, 'Update calendar event'),
+        (UPDATE_PARENT_GC_EVENT, 'Update parent calendar event'),
+        (DELETE_GC_EVENT, 'Delete calendar event'),
+        (CHANGE_EMAIL, 'Change notification email'),
+        (DELETE_EMAIL, 'Delete notification email'),
+    )
+
+    CALENDAR_KINDS = (UPDATE_GC_EVENT, UPDATE_PARENT_GC_EVENT, DELETE_GC_EVENT)
+    STUDENT_KINDS = (UPDATE_PARENT_GC_EVENT,)
+
+    kind = models.CharField(max_length=32, choices=KIND_CHOICES)
+    object_id = models.IntegerField()
+    payload = models.JSONField(default=dict)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    available_at = models.DateTimeField(default=timezone.now, db_index=True)
+    last_error = models.TextField(blank=True)
+    create_date = models.DateTimeField(auto_now_add=True)
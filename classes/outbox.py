@@ -0,0 +1,179 @@
+# blocking google calendar calls run on this pool
+GC_SYNC_WORKERS = 8
+GC_SYNC_POOL = ThreadPoolExecutor(max_workers=GC_SYNC_WORKERS, thread_name_prefix='gc-sync')
+
+OUTBOX_BATCH_SIZE = 50
+OUTBOX_MAX_ATTEMPTS = 8
+OUTBOX_BACKOFF = 30  # seconds, doubled on every failed attempt
+OUTBOX_LEASE = 300  # seconds a claimed message is hidden from other workers
+
+
+def change_gc_events(calls):
+    """
+    Change google calendar events.
+    The calls run on the bounded GC_SYNC_POOL and all of them are awaited
+    :param calls: list of (key, call), see update_gc_event_call()
+    :return: list of (key, error) for the failed events
+    """
+    if not calls:
+        return []
+
+    event_loop = asyncio.new_event_loop()
+
+    try:
+        results = event_loop.run_until_complete(asyncio.gather(*[run_gc_call(key, call) for key, call in calls]))
+    finally:
+        event_loop.close()
+
+    return [result for result in results if result]
+
+
+async def run_gc_call(key, call):
+    """
+    Run a blocking google calendar call on the thread pool
+    :param key: identifies the call in the failures
+    :param call: callable
+    :return: None or (key, error)
+    """
+    event_loop = asyncio.get_running_loop()
+
+    try:
+        await event_loop.run_in_executor(GC_SYNC_POOL, call)
+    except Exception as e:
+        logger.exception('Google calendar call %s failed', key)
+        return key, e
+
+
+def update_gc_event_call(inst):
+    """
+    Update google calendar event.
+    The event data is read here, so the pool threads get plain values and don't open database connections
+    :param inst:
+    :return: callable
+    """
+    return partial(prepare_data_and_update_event,
+                   inst.gc_event_id, inst.location.calendarId,
+                   event_name=inst.gc_title,
+                   description=inst.gc_event_description,
+                   attendees=inst.gc_event_attendees,
+                   start_date=inst.class_date,
+                   start_time=inst.start_time,
+                   end_time=inst.end_time)
+
+
+def update_parent_gc_event_call(student_in_class):
+    """
+    Update google calendar event.
+    Cancelled students are no longer in the class, their event is in the calendar of the last class
+    :param student_in_class:
+    :return: callable or None without a parent event
+    """
+    class_instance = student_in_class.class_id or student_in_class.last_class
+
+    if student_in_class.gc_parent_event_id:
+        return partial(prepare_data_and_update_event,
+                       student_in_class.gc_parent_event_id,
+                       class_instance.location.parent_calendarId,
+                       event_name=student_in_class.gc_parent_title,
+                       description=student_in_class.gc_parent_event_description)
+
+
+def delete_gc_event_call(inst):
+    return partial(delete_gcalendar_event, inst.location.calendarId, inst.gc_event_id)
+
+
+def claim_outbox_batch(batch_size):
+    """
+    Lock a batch of due messages and hide it from the other workers for OUTBOX_LEASE
+    :param batch_size:
+    :return: list of messages
+    """
+    now = timezone.now()
+
+    with transaction.atomic():
+        batch = list(RolloutOutbox.objects.select_for_update(skip_locked=True)
+                                          .filter(available_at__lte=now, attempts__lt=OUTBOX_MAX_ATTEMPTS)
+                                          .order_by('id')[:batch_size])
+
+        RolloutOutbox.objects.filter(id__in=[message.id for message in batch])\
+                             .update(available_at=now + timedelta(seconds=OUTBOX_LEASE))
+
+    return batch
+
+
+def drain_rollout_outbox(batch_size=OUTBOX_BATCH_SIZE):
+    """
+    Deliver one batch of the outbox.
+    Calendar calls of the batch run concurrently, one per event: the calls read the current state
+    of the object, so only the last calendar message of an object is delivered and the earlier ones
+    are superseded by it. Failed messages are retried with backoff
+    :param batch_size:
+    :return: number of processed messages
+    """
+    batch = claim_outbox_batch(batch_size)
+
+    if not batch:
+        return 0
+
+    student_kinds = RolloutOutbox.STUDENT_KINDS
+    rollouts = ClassRollout.objects.select_related(*ROLLOUT_RELATED).in_bulk(
+        [message.object_id for message in batch if message.kind not in student_kinds])
+    students = StudentInClass.objects.select_related('class_id__location', 'last_class__location').in_bulk(
+        [message.object_id for message in batch if message.kind in student_kinds])
+
+    last_calendar_messages = {
+        (message.kind in student_kinds, message.object_id): message.id
+        for message in batch if message.kind in RolloutOutbox.CALENDAR_KINDS
+    }
+
+    calls = []
+    failures = {}
+
+    for message in batch:
+        obj = (students if message.kind in student_kinds else rollouts).get(message.object_id)
+
+        if (message.kind in RolloutOutbox.CALENDAR_KINDS and
+                last_calendar_messages[(message.kind in student_kinds, message.object_id)] != message.id):
+            continue
+
+        if obj is None:
+            logger.warning('Outbox message %s: %s %s no longer exists', message.id, message.kind, message.object_id)
+
+        elif message.kind == RolloutOutbox.UPDATE_GC_EVENT:
+            calls.append((message.id, update_gc_event_call(obj)))
+
+        elif message.kind == RolloutOutbox.UPDATE_PARENT_GC_EVENT:
+            call = update_parent_gc_event_call(obj)
+
+            if call:
+                calls.append((message.id, call))
+
+        elif message.kind == RolloutOutbox.DELETE_GC_EVENT:
+            calls.append((message.id, delete_gc_event_call(obj)))
+
+        else:
+            try:
+                if message.kind == RolloutOutbox.CHANGE_EMAIL:
+                    obj.send_change_event_notification_email(obj, message.payload['count'],
+                                                             user=message.payload['user'])
+                else:
+                    obj.send_delete_event_notification_email(obj, message.payload['email_date'],
+                                                             user=message.payload['user'])
+            except Exception as e:
+                logger.exception('Outbox message %s: %s failed', message.id, message.kind)
+                failures[message.id] = e
+
+    failures.update(change_gc_events(calls))
+
+    now = timezone.now()
+    failed = [message for message in batch if message.id in failures]
+
+    for message in failed:
+        message.attempts += 1
+        message.available_at = now + timedelta(seconds=OUTBOX_BACKOFF * 2 ** (message.attempts - 1))
+        message.last_error = repr(failures[message.id])
+
+    RolloutOutbox.objects.filter(id__in=[message.id for message in batch if message.id not in failures]).delete()
+    RolloutOutbox.objects.bulk_update(failed, ['attempts', 'available_at', 'last_error'])
+
+    return len(batch)
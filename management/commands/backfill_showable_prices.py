@@ -0,0 +1,12 @@
+class Command(BaseCommand):
+    """
+    manage.py backfill_showable_prices, see backfill_showable_prices()
+    """
+    help = 'Recompute the denormalized showable price of all products'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=SHOWABLE_PRICE_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        total = backfill_showable_prices(options['chunk_size'])
+        self.stdout.write('Recomputed {} products'.format(total))
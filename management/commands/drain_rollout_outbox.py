@@ -0,0 +1,20 @@
+class Command(BaseCommand):
+    """
+    manage.py drain_rollout_outbox, see drain_rollout_outbox()
+    """
+    help = 'Deliver the queued rollout calendar updates and notification emails'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=OUTBOX_BATCH_SIZE)
+        parser.add_argument('--interval', type=float, default=1.0)
+        parser.add_argument('--once', action='store_true')
+
+    def handle(self, *args, **options):
+        while True:
+            processed = drain_rollout_outbox(options['batch_size'])
+
+            if options['once'] and not processed:
+                return
+
+            if not processed:
+                time.sleep(options['interval'])
@@ -0,0 +1,45 @@
+ORDERED_PAGE_FUNCTIONS_SQL = '''
+CREATE OR REPLACE FUNCTION get_ordered_page(value_id integer[], value_limit integer, value_offset integer)
+RETURNS SETOF products_product
+LANGUAGE sql STABLE
+AS $function$
+SELECT p.*
+FROM (
+SELECT id, MIN(position) AS position
+FROM unnest(value_id) WITH ORDINALITY AS o(id, position)
+GROUP BY id
+) o
+JOIN products_product p ON p.id = o.id
+WHERE p.is_active = TRUE
+ORDER BY o.position LIMIT value_limit OFFSET value_offset;
+$function$;
+
+CREATE OR REPLACE FUNCTION get_ordered_page_count(value_id integer[])
+RETURNS integer
+LANGUAGE sql STABLE
+AS $function$
+SELECT COUNT(*)::integer
+FROM (SELECT DISTINCT unnest(value_id) AS id) o
+JOIN products_product p ON p.id = o.id
+WHERE p.is_active = TRUE;
+$function$;
+'''
+
+DROP_ORDERED_PAGE_FUNCTIONS_SQL = '''
+DROP FUNCTION IF EXISTS get_ordered_page(integer[], integer, integer);
+DROP FUNCTION IF EXISTS get_ordered_page_count(integer[]);
+'''
+
+
+class Migration(migrations.Migration):
+    """
+    Paginator functions ordered by the array position instead of idx(), see CustomPaginator
+    """
+
+    dependencies = [
+        ('products', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunSQL(ORDERED_PAGE_FUNCTIONS_SQL, DROP_ORDERED_PAGE_FUNCTIONS_SQL),
+    ]
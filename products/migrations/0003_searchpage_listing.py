@@ -0,0 +1,38 @@
+SEARCHPAGE_LISTING_SQL = '''
+CREATE TABLE products_searchpage_materialized (
+search_page_id integer PRIMARY KEY REFERENCES products_searchpage (id) ON DELETE CASCADE
+);
+
+CREATE TABLE products_searchpage_listing (
+search_page_id integer NOT NULL REFERENCES products_searchpage (id) ON DELETE CASCADE,
+position integer NOT NULL,
+product_id integer NOT NULL,
+CONSTRAINT products_searchpage_listing_position UNIQUE (search_page_id, position)
+DEFERRABLE INITIALLY IMMEDIATE
+);
+
+CREATE INDEX products_searchpage_listing_product ON products_searchpage_listing (product_id);
+'''
+
+DROP_SEARCHPAGE_LISTING_SQL = '''
+DROP TABLE IF EXISTS products_searchpage_listing;
+DROP TABLE IF EXISTS products_searchpage_materialized;
+'''
+
+
+class Migration(migrations.Migration):
+    """
+    Materialized ordering of the opted-in SearchPages, see materialize_listing().
+    The position constraint is checked at the end of each statement,
+    REMOVE_FROM_LISTINGS_SQL shifts the positions after a removed product in one UPDATE.
+    product_id has no foreign key, a deleted product is removed by the post_delete signal
+    so that the positions after it are shifted
+    """
+
+    dependencies = [
+        ('products', '0002_ordered_page_functions'),
+    ]
+
+    operations = [
+        migrations.RunSQL(SEARCHPAGE_LISTING_SQL, DROP_SEARCHPAGE_LISTING_SQL),
+    ]
@@ -0,0 +1,20 @@
+class Migration(migrations.Migration):
+    """
+    Denormalized showcase pricing, filled by manage.py backfill_showable_prices
+    """
+
+    dependencies = [
+        ('products', '0003_searchpage_listing'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductShowablePrice',
+            fields=[
+                ('product', models.OneToOneField(on_delete=models.CASCADE, primary_key=True, related_name='showable',
+                                                 serialize=False, to='products.product')),
+                ('showable_price', models.DecimalField(decimal_places=2, max_digits=10, null=True)),
+                ('is_lux', models.BooleanField(null=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,8 @@
+class ProductShowablePrice(models.Model):
+    """
+    Denormalized showcase pricing of the product, see recompute_showable_prices()
+    """
+    product = models.OneToOneField(Product, primary_key=True, related_name='showable',
+                                   on_delete=models.CASCADE)
+    showable_price = models.DecimalField(max_digits=10, decimal_places=2, null=True)
+    is_lux = models.BooleanField(null=True)
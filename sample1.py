@@ -1,3 +1,160 @@
+ORDER_IDS_CACHE_KEY = u'paginator:listing_ids:{}:{}:{}'
+MATERIALIZED_CACHE_KEY = u'paginator:materialized:{}'
+COUNT_CACHE_KEY = u'paginator:count:{}:{}:{}'
+ACTIVE_IDS_CACHE_KEY = u'paginator:active_ids:{}:{}:{}'
+
+# the signals drop the order ids on save, the TTL corrects the writes that bypass them
+# (queryset updates of _ordered_m2m_ordering)
+ORDER_IDS_CACHE_TIMEOUT = 60 * 60
+
+# the signals keep the count current, the TTL corrects the drift of missed increments
+# (is_active flips during a count query, queryset updates)
+COUNT_CACHE_TIMEOUT = 60 * 5
+
+# matches a product id inside the serialized _ordered_m2m_ordering list
+ORDERING_ID_REGEX = r'[\[,]\s*{}\s*[,\]]'
+
+# pages fetched ahead of the requested one, see CustomPaginator.read_ahead
+READ_AHEAD_CACHE_KEY = u'paginator:read_ahead:{}:{}:{}:{}:{}:{}:{}'
+READ_AHEAD_STATS_KEY = u'paginator:read_ahead_stats:{}:{}'
+READ_AHEAD_TIMEOUT = 60
+
+# seconds before a process without the ordered paginator functions looks for them again
+ORDERED_FUNCTIONS_RECHECK = 60
+
+# page rows and the total active count in one statement
+PAGE_WITH_COUNT_SQL = u'''
+SELECT {}, COUNT(*) OVER () AS total_count
+FROM (
+SELECT id, MIN(position) AS position
+FROM unnest(%s::integer[]) WITH ORDINALITY AS o(id, position)
+GROUP BY id
+) o
+JOIN products_product p ON p.id = o.id
+WHERE p.is_active = TRUE
+ORDER BY o.position LIMIT %s OFFSET %s
+'''
+
+# active ids of the listing in its order, read by the seek pages
+ACTIVE_IDS_SQL = u'''
+SELECT o.id
+FROM (
+SELECT id, MIN(position) AS position
+FROM unnest(%s::integer[]) WITH ORDINALITY AS o(id, position)
+GROUP BY id
+) o
+JOIN products_product p ON p.id = o.id
+WHERE p.is_active = TRUE
+ORDER BY o.position
+'''
+
+# materialized ordering of the opted-in SearchPages, see materialize_listing()
+MATERIALIZE_LISTING_SQL = u'''
+DELETE FROM products_searchpage_listing WHERE search_page_id = %(page)s;
+INSERT INTO products_searchpage_listing (search_page_id, position, product_id)
+SELECT %(page)s, ROW_NUMBER() OVER (ORDER BY o.position), o.id
+FROM (
+SELECT id, MIN(position) AS position
+FROM unnest(%(ids)s::integer[]) WITH ORDINALITY AS o(id, position)
+GROUP BY id
+) o
+JOIN products_product p ON p.id = o.id
+WHERE p.is_active = TRUE
+'''
+
+# drop a product from every materialized listing and close the gap it leaves
+REMOVE_FROM_LISTINGS_SQL = u'''
+WITH removed AS (
+DELETE FROM products_searchpage_listing WHERE product_id = %s
+RETURNING search_page_id, position
+)
+UPDATE products_searchpage_listing l
+SET position = l.position - 1
+FROM removed r
+WHERE l.search_page_id = r.search_page_id AND l.position > r.position
+'''
+
+MATERIALIZED_PAGE_SQL = u'''
+SELECT {}
+FROM products_searchpage_listing l
+JOIN products_product p ON p.id = l.product_id
+WHERE l.search_page_id = %s AND l.position BETWEEN %s AND %s
+ORDER BY l.position
+'''
+
+
+def parse_ordering(page):
+    """
+    Product ids of the SearchPage or Special curated ordering
+    :param page:
+    :return: list of ids
+    """
+    try:
+        return [int(i) for i in page._ordered_m2m_ordering.split('[')[1]
+                                                          .split(']')[0]
+                                                          .split(',')]
+    except:
+        return []
+
+
+def order_ids_cache_key(search_model, slug, type_product):
+    return ORDER_IDS_CACHE_KEY.format(search_model, slug, type_product)
+
+
+def count_cache_key(search_model, slug, type_product):
+    return COUNT_CACHE_KEY.format(search_model, slug, type_product)
+
+
+def active_ids_cache_key(search_model, slug, type_product):
+    return ACTIVE_IDS_CACHE_KEY.format(search_model, slug, type_product)
+
+
+def read_ahead_stats(read_ahead):
+    """
+    Hit rate of the parked pages for a read-ahead window
+    :param read_ahead: number of pages fetched ahead
+    :return: dict
+    """
+    hits = cache.get(READ_AHEAD_STATS_KEY.format(read_ahead, u'hits'), 0)
+    misses = cache.get(READ_AHEAD_STATS_KEY.format(read_ahead, u'misses'), 0)
+    total = hits + misses
+
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_rate': float(hits) / total if total else 0.0
+    }
+
+
+def in_worker(func):
+    """
+    Async wrapper running func in a worker thread.
+    The thread connection is checked and closed like a request's,
+    CONN_MAX_AGE is not enforced outside the request thread otherwise
+    :param func:
+    :return: coroutine function
+    """
+    def run(*args, **kwargs):
+        close_old_connections()
+
+        try:
+            return func(*args, **kwargs)
+        finally:
+            close_old_connections()
+
+    return sync_to_async(run, thread_sensitive=False)
+
+
+def _count_read_ahead(read_ahead, result):
+    key = READ_AHEAD_STATS_KEY.format(read_ahead, result)
+
+    if not cache.add(key, 1, None):
+        try:
+            cache.incr(key)
+        except ValueError:
+            pass
+
+
 class CustomPaginator(Paginator):
     """
     A custom class inherited from the base Paginator class.
@@ -39,11 +196,26 @@ class CustomPaginator(Paginator):
     WHERE id = ANY(value_id) AND is_active = TRUE);
     END
     $function$;
+
+    Faster versions without idx(), get_ordered_page and get_ordered_page_count,
+    are installed by products/migrations/0002_ordered_page_functions.py
+    and used instead of the functions above once the migration has run.
+    Ordering comes from the array position, so sorting is O(n log n) instead of O(n^2).
+
+    Hot SearchPages can read their ordering from the products_searchpage_listing table
+    of products/migrations/0003_searchpage_listing.py (materialized=True).
+    Pages are opted in by materialize_listing(), the others use the functions above.
     """
 
+    # installed ordered paginator functions, a missing install is checked again
+    # after ORDERED_FUNCTIONS_RECHECK, so workers pick up the migration without a restart
+    _ordered_functions = None
+    _ordered_functions_checked = 0
+
     def __init__(self, object_list, per_page, orphans=0,
                  allow_empty_first_page=True, slug=None, 
-                 type_product=None, paginate_by=10, search_model=u'SearchPage'):
+                 type_product=None, paginate_by=10, search_model=u'SearchPage',
+                 seek=False, read_ahead=0, fields=None, materialized=False):
         self.object_list = object_list
         self.per_page = int(per_page)
         self.orphans = int(orphans)
@@ -52,37 +224,509 @@ class CustomPaginator(Paginator):
         self.slug = slug
         self.type_product = type_product
         self.paginate_by = paginate_by
+        self.seek = seek
+        self.read_ahead = int(read_ahead)
+        self.fields = self._validate_fields(fields)
+        self._active_ids = None
+        self._prefetched_page = None
+
+        if search_model == u'Special':
+            type_product = u'listing'
+
+        self._listing = (search_model, slug, type_product)
+
+        cache_key = order_ids_cache_key(search_model, slug, type_product)
+        cached_listing = cache.get(cache_key)
+
+        if cached_listing is None:
+            self.page_id, self.order_ids = self._load_listing(search_model)
+            cache.set(cache_key, (self.page_id, array('i', self.order_ids).tobytes()), ORDER_IDS_CACHE_TIMEOUT)
+        else:
+            self.page_id, cached_ids = cached_listing
+            order_ids = array('i')
+            order_ids.frombytes(cached_ids)
+            self.order_ids = order_ids.tolist()
+
+        # pages that are not opted in use the regular path
+        self.materialized = bool(materialized and search_model == u'SearchPage' and
+                                 is_materialized(self.page_id))
+
+        # active products count, maintained by the Product and ordering signals
+        self._count_cache_key = count_cache_key(search_model, slug, type_product)
+        self._count = cache.get(self._count_cache_key)
+        self._active_ids_cache_key = active_ids_cache_key(search_model, slug, type_product)
+
+    @classmethod
+    async def acreate(cls, *args, **kwargs):
+        """
+        Build the paginator from async code, the listing lookup runs in a worker thread
+        :return: CustomPaginator
+        """
+        return await in_worker(cls)(*args, **kwargs)
+
+    def _load_listing(self, search_model):
+        """
+        Load the SearchPage or Special with its curated ordering
+        :param search_model:
+        :return: page id and list of product ids
+        """
+        page = None
 
         if search_model == u'SearchPage':
             page = SearchPage.objects.get(slug=self.slug, type=self.type_product)
             
         elif search_model == u'Special':
-            page = Special.objects.get(slug=slug, type=u'listing')
+            page = Special.objects.get(slug=self.slug, type=u'listing')
 
-        try:
-            self.order_ids = [int(i) for i in page._ordered_m2m_ordering.split('[')[1]
-                                                                        .split(']')[0]
-                                                                        .split(',')]
-        except:
-            self.order_ids = []
+        return getattr(page, 'pk', None), parse_ordering(page)
 
     def page(self, number):
+        if self._count is None and not (self.seek or self.materialized):
+            self._fetch_page_with_count(number)
+
         number = self.validate_number(number)
-        bottom = (number - 1) * self.per_page
-        page_objects = list(Product.objects.raw('SELECT * FROM get_page(%s, %s, %s)', 
-                            [self.order_ids, self.paginate_by, bottom]))
+
+        if self._prefetched_page and self._prefetched_page[0] == number:
+            page_objects = self._prefetched_page[1]
+        else:
+            page_objects = self._get_page_objects(number)
         
         return self._get_page(page_objects, number, self)
 
+    async def apage(self, number):
+        """
+        Async version of page() for ASGI views.
+        The count and the page rows run concurrently on separate connections,
+        so a cold page costs max(count, page) instead of the sum.
+        The worker queries run outside the ATOMIC_REQUESTS transaction
+        :param number:
+        :return:
+        """
+        try:
+            number = int(number)
+        except (TypeError, ValueError):
+            number = self.validate_number(number)
+
+        if number < 1:
+            number = self.validate_number(number)
+
+        get_rows = in_worker(self._get_page_objects)(number)
+
+        if self._count is None:
+            _, page_objects = await asyncio.gather(self.acount(), get_rows)
+        else:
+            page_objects = await get_rows
+
+        number = self.validate_number(number)
+
+        return self._get_page(page_objects, number, self)
+
+    def _get_page_objects(self, number):
+        """
+        Rows of the page, served from the read-ahead cache when it was fetched earlier
+        :param number: valid page number
+        :return: list of products
+        """
+        if self.read_ahead:
+            page_objects = cache.get(self._read_ahead_key(number))
+
+            if page_objects is not None:
+                _count_read_ahead(self.read_ahead, u'hits')
+
+                if self.fields:
+                    return [self._row_class._make(row) for row in page_objects]
+
+                return page_objects
+
+            _count_read_ahead(self.read_ahead, u'misses')
+
+        bottom = (number - 1) * self.per_page
+
+        if self.materialized:
+            rows, _ = self._query_rows(MATERIALIZED_PAGE_SQL,
+                                       [self.page_id, bottom + 1, bottom + self._read_ahead_limit()])
+        elif self.seek:
+            rows = self._seek_page(bottom, self._read_ahead_limit())
+        else:
+            rows, _ = self._query_rows(
+                'SELECT {{}} FROM {}(%s, %s, %s) p'.format(self._sql_function('get_page')),
+                [self.order_ids, self._read_ahead_limit(), bottom])
+
+        return self._park_pages(number, rows)
+
+    def _read_ahead_key(self, number):
+        # projected and full pages of the same listing must not share entries
+        projection = hashlib.md5(u','.join(self.fields).encode('utf-8')).hexdigest() if self.fields else u'*'
+        return READ_AHEAD_CACHE_KEY.format(*(self._listing + (self.per_page, self.paginate_by, projection, number)))
+
+    def _read_ahead_limit(self):
+        return self.per_page * self.read_ahead + self.paginate_by
+
+    def _park_pages(self, number, rows):
+        """
+        Put the pages after the requested one to the cache for the next requests
+        :param number: requested page number
+        :param rows: rows of the requested page followed by the read-ahead pages
+        :return: rows of the requested page
+        """
+        parked = {}
+
+        for i in range(1, self.read_ahead + 1):
+            page_objects = rows[i * self.per_page:i * self.per_page + self.paginate_by]
+
+            if not page_objects:
+                break
+
+            if self.fields:
+                page_objects = [tuple(row) for row in page_objects]
+
+            parked[self._read_ahead_key(number + i)] = page_objects
+
+        if parked:
+            cache.set_many(parked, READ_AHEAD_TIMEOUT)
+
+        return rows[:self.paginate_by]
+
+    def _validate_fields(self, fields):
+        """
+        Product fields to load instead of full Product instances.
+        Taken by attname (category_id, not category), the name values_list() and the rows use,
+        the raw page queries select the matching columns
+        :param fields: list of field attnames or None
+        :return:
+        """
+        if not fields:
+            return None
+
+        columns = {f.attname: f.column for f in Product._meta.concrete_fields}
+        unknown = set(fields) - set(columns)
+
+        if unknown:
+            raise ValueError(u'Unknown product fields: {}'.format(', '.join(sorted(unknown))))
+
+        # id goes first, seek pages are reordered by it
+        fields = [u'id'] + [f for f in fields if f != u'id']
+        self._columns = [columns[f] for f in fields]
+        self._row_class = namedtuple('ProductRow', fields)
+
+        return fields
+
+    def _query_rows(self, sql, params, with_count=False):
+        """
+        Run a page query, hydrating Product instances or projected rows
+        :param sql: query with a placeholder for the selected columns
+        :param params:
+        :param with_count: the last column is the total count
+        :return: rows and the total count
+        """
+        count = None
+
+        if not self.fields:
+            rows = list(Product.objects.raw(sql.format(u'p.*'), params))
+
+            if with_count and rows:
+                count = rows[0].total_count
+
+            return rows, count
+
+        cursor = connection.cursor()
+        cursor.execute(sql.format(', '.join(u'p.' + connection.ops.quote_name(c) for c in self._columns)),
+                       params)
+        fetched = cursor.fetchall()
+
+        if with_count and fetched:
+            count = fetched[0][-1]
+
+        return [self._row_class._make(row[:len(self.fields)]) for row in fetched], count
+
+    def _fetch_page_with_count(self, number):
+        """
+        Load the page rows together with the total count,
+        so validate_number() doesn't need a separate count query
+        :param number: raw page number
+        :return:
+        """
+        try:
+            number = int(number)
+        except (TypeError, ValueError):
+            return
+
+        if number < 1:
+            return
+
+        bottom = (number - 1) * self.per_page
+        rows, count = self._query_rows(PAGE_WITH_COUNT_SQL,
+                                       [self.order_ids, self._read_ahead_limit(), bottom],
+                                       with_count=True)
+
+        # an empty page past the end says nothing about the count
+        if rows:
+            self._store_count(count)
+        elif not bottom:
+            self._store_count(0)
+
+        self._prefetched_page = (number, self._park_pages(number, rows))
+
+    def _sql_function(self, name):
+        """
+        Name of the fastest installed version of the paginator function
+        :param name: get_page or get_page_count
+        :return:
+        """
+        now = time.monotonic()
+
+        if CustomPaginator._ordered_functions is None or (
+                not CustomPaginator._ordered_functions and
+                now - CustomPaginator._ordered_functions_checked > ORDERED_FUNCTIONS_RECHECK):
+            cursor = connection.cursor()
+            cursor.execute("SELECT EXISTS(SELECT 1 FROM pg_proc WHERE proname = 'get_ordered_page')")
+            CustomPaginator._ordered_functions = cursor.fetchone()[0]
+            CustomPaginator._ordered_functions_checked = now
+
+        if CustomPaginator._ordered_functions:
+            return name.replace('get_page', 'get_ordered_page')
+
+        return name
+
+    def _get_active_ids(self):
+        """
+        Ids of the active products in the SearchPage order.
+        Cached next to the count and dropped by the same signals,
+        so a warm seek page only loads its own rows
+        """
+        if self._active_ids is None:
+            cached_ids = cache.get(self._active_ids_cache_key)
+
+            if cached_ids is None:
+                cursor = connection.cursor()
+                cursor.execute(ACTIVE_IDS_SQL, [self.order_ids])
+                self._active_ids = [row[0] for row in cursor.fetchall()]
+                cache.set(self._active_ids_cache_key, array('i', self._active_ids).tobytes(), COUNT_CACHE_TIMEOUT)
+            else:
+                active_ids = array('i')
+                active_ids.frombytes(cached_ids)
+                self._active_ids = active_ids.tolist()
+
+        return self._active_ids
+
+    def _seek_page(self, bottom, limit):
+        """
+        Fetch a page by position instead of OFFSET.
+        Only the ids of the requested page are loaded, so page N costs the same as page 1.
+        """
+        page_ids = self._get_active_ids()[bottom:bottom + limit]
+
+        if self.fields:
+            products = {row[0]: self._row_class._make(row) for row in
+                        Product.objects.filter(id__in=page_ids).values_list(*self.fields)}
+        else:
+            products = Product.objects.in_bulk(page_ids)
+
+        return [products[i] for i in page_ids if i in products]
+
+    def _store_count(self, count):
+        self._count = count
+        cache.add(self._count_cache_key, count, COUNT_CACHE_TIMEOUT)
+
     def _get_count(self):
+        if self._count is None and self.seek:
+            self._store_count(len(self._get_active_ids()))
+
+        # positions are dense, the last one is the count.
+        # Not shared with the regular paginators through the count cache
+        if self._count is None and self.materialized:
+            cursor = connection.cursor()
+            cursor.execute('SELECT COALESCE(MAX(position), 0) FROM products_searchpage_listing '
+                           'WHERE search_page_id = %s', [self.page_id])
+            self._count = cursor.fetchone()[0]
+
         if self._count is None:
             try:
                 cursor = connection.cursor()
-                cursor.execute('SELECT * FROM get_page_count(%s)', [self.order_ids])
-                self._count = cursor.fetchone()[0]
+                cursor.execute('SELECT * FROM {}(%s)'.format(self._sql_function('get_page_count')),
+                               [self.order_ids])
+                self._store_count(cursor.fetchone()[0])
             except (AttributeError, TypeError):
                 self._count = len(self.object_list)
                 
         return self._count
     
+    async def acount(self):
+        if self._count is None:
+            await in_worker(self._get_count)()
+
+        return self._count
+
     count = property(_get_count)
+
+
+def listing_cache_keys(search_model, instance):
+    """
+    Cached order ids, count and active ids of a SearchPage or Special,
+    under its current slug and type and the ones it was loaded with
+    :param search_model:
+    :param instance:
+    :return: list of keys
+    """
+    listings = {(instance.slug, instance.type),
+                getattr(instance, '_loaded_listing', (instance.slug, instance.type))}
+
+    return [cache_key(search_model, slug, type_product) for slug, type_product in listings
+            for cache_key in (order_ids_cache_key, count_cache_key, active_ids_cache_key)]
+
+
+@receiver(post_init, sender=SearchPage)
+@receiver(post_init, sender=Special)
+def remember_listing(sender, instance, **kwargs):
+    # read from __dict__, deferred fields are not loaded for this
+    instance._loaded_listing = (instance.__dict__.get('slug'), instance.__dict__.get('type'))
+
+
+@receiver([post_save, post_delete], sender=SearchPage)
+def invalidate_search_page_order_ids(sender, instance, **kwargs):
+    cache.delete_many(listing_cache_keys(u'SearchPage', instance))
+    instance._loaded_listing = (instance.slug, instance.type)
+
+
+def materialize_listing(search_page):
+    """
+    Opt the SearchPage in to the materialized ordering or rebuild its rows
+    :param search_page:
+    :return:
+    """
+    with transaction.atomic():
+        cursor = connection.cursor()
+        cursor.execute('INSERT INTO products_searchpage_materialized (search_page_id) VALUES (%s) '
+                       'ON CONFLICT DO NOTHING', [search_page.pk])
+        cursor.execute(MATERIALIZE_LISTING_SQL, {'page': search_page.pk, 'ids': parse_ordering(search_page)})
+
+    cache.delete(MATERIALIZED_CACHE_KEY.format(search_page.pk))
+
+
+def dematerialize_listing(search_page):
+    """
+    Opt the SearchPage out, its paginators go back to the regular path.
+    The rows of a deleted SearchPage are dropped by the foreign keys
+    :param search_page:
+    :return:
+    """
+    with transaction.atomic():
+        cursor = connection.cursor()
+        cursor.execute('DELETE FROM products_searchpage_materialized WHERE search_page_id = %s', [search_page.pk])
+        cursor.execute('DELETE FROM products_searchpage_listing WHERE search_page_id = %s', [search_page.pk])
+
+    cache.delete(MATERIALIZED_CACHE_KEY.format(search_page.pk))
+
+
+def is_materialized(page_id):
+    """
+    Whether the SearchPage is opted in, cached until materialize_listing() or dematerialize_listing()
+    :param page_id:
+    :return: bool
+    """
+    cache_key = MATERIALIZED_CACHE_KEY.format(page_id)
+    materialized = cache.get(cache_key)
+
+    if materialized is None:
+        materialized = bool(page_id and materialized_page_ids([page_id]))
+        cache.set(cache_key, materialized, ORDER_IDS_CACHE_TIMEOUT)
+
+    return materialized
+
+
+def materialized_page_ids(page_ids=None):
+    """
+    Opted-in SearchPage ids
+    :param page_ids: only check these pages
+    :return: list of ids
+    """
+    cursor = connection.cursor()
+
+    if page_ids is None:
+        cursor.execute('SELECT search_page_id FROM products_searchpage_materialized')
+    else:
+        cursor.execute('SELECT search_page_id FROM products_searchpage_materialized '
+                       'WHERE search_page_id = ANY(%s)', [list(page_ids)])
+
+    return [row[0] for row in cursor.fetchall()]
+
+
+@receiver(post_save, sender=SearchPage)
+def refresh_materialized_listing(sender, instance, **kwargs):
+    if is_materialized(instance.pk):
+        materialize_listing(instance)
+
+
+@receiver([post_save, post_delete], sender=Special)
+def invalidate_special_order_ids(sender, instance, **kwargs):
+    cache.delete_many(listing_cache_keys(u'Special', instance))
+    instance._loaded_listing = (instance.slug, instance.type)
+
+
+def update_listing_counts(product_id, delta):
+    """
+    Shift the cached active count of every listing containing the product
+    and drop its cached active ids.
+    Cold counts are left alone, they are computed on the next request.
+    :param product_id:
+    :param delta: 1 or -1
+    :return:
+    """
+    pattern = ORDERING_ID_REGEX.format(product_id)
+    listings = [(u'SearchPage', slug, type_product) for slug, type_product in
+                SearchPage.objects.filter(_ordered_m2m_ordering__regex=pattern).values_list('slug', 'type')]
+    listings += [(u'Special', slug, u'listing') for slug in
+                 Special.objects.filter(_ordered_m2m_ordering__regex=pattern, type=u'listing')
+                                .values_list('slug', flat=True)]
+
+    for listing in listings:
+        try:
+            cache.incr(count_cache_key(*listing), delta)
+        except ValueError:
+            pass
+
+    cache.delete_many([active_ids_cache_key(*listing) for listing in listings])
+
+
+@receiver(post_init, sender=Product)
+def remember_product_activity(sender, instance, **kwargs):
+    # read from __dict__, a deferred is_active is looked up on save instead
+    instance._was_active = instance.__dict__.get('is_active')
+
+
+@receiver(pre_save, sender=Product)
+def load_product_activity(sender, instance, update_fields=None, **kwargs):
+    if instance._was_active is None and instance.pk and (update_fields is None or 'is_active' in update_fields):
+        instance._was_active = sender.objects.filter(pk=instance.pk, is_active=True).exists()
+
+
+@receiver(post_save, sender=Product)
+def product_activity_changed(sender, instance, created=False, update_fields=None, **kwargs):
+    if update_fields is not None and 'is_active' not in update_fields:
+        return
+
+    was_active = False if created else bool(instance._was_active)
+    instance._was_active = bool(instance.is_active)
+
+    if was_active == instance._was_active:
+        return
+
+    update_listing_counts(instance.pk, 1 if instance.is_active else -1)
+
+    if instance.is_active:
+        # the position depends on the neighbours, rebuild the listings containing the product
+        for search_page in SearchPage.objects.filter(pk__in=materialized_page_ids(),
+                                                     _ordered_m2m_ordering__regex=ORDERING_ID_REGEX.format(instance.pk)):
+            materialize_listing(search_page)
+    else:
+        cursor = connection.cursor()
+        cursor.execute(REMOVE_FROM_LISTINGS_SQL, [instance.pk])
+
+
+@receiver(post_delete, sender=Product)
+def product_deleted(sender, instance, **kwargs):
+    if instance.is_active:
+        update_listing_counts(instance.pk, -1)
+
+        cursor = connection.cursor()
+        cursor.execute(REMOVE_FROM_LISTINGS_SQL, [instance.pk])
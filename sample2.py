@@ -1,24 +1,757 @@
+SHOWCASE_CACHE_TIMEOUT = 60 * 60
+SHOWCASE_CACHE_KEY = u'showcase:{}:{}:{}'
+SHOWCASE_VERSION_KEY = u'showcase:version'
+
+# expired entries are served for this long while one worker rebuilds them
+SHOWCASE_STALE_TIMEOUT = 60 * 60 * 24
+SHOWCASE_REBUILD_LOCK_TIMEOUT = 60
+# missing entries are built by one worker, the others wait for it this long
+SHOWCASE_REBUILD_WAIT = 5
+SHOWCASE_REBUILD_POLL = 0.1
+SHOWCASE_METRICS_KEY = u'showcase:metrics:{}'
+
+# the agents are random on every hit, they are spliced into the cached page here
+AGENTS_PLACEHOLDER = u'<!-- showcase-agents -->'
+AGENT_IDS_CACHE_KEY = u'showcase:agent_ids'
+# the signals drop the ids after commit, the TTL corrects the writes that bypass them
+AGENT_IDS_CACHE_TIMEOUT = 60 * 10
+
+# the cached page is shared between visitors, each response gets its own token here
+CSRF_TOKEN_PLACEHOLDER = u'showcase-csrf-token'
+
+ProductOption = Product._meta.get_field('options').related_model
+ProductPrice = ProductOption._meta.get_field('prices').related_model
+TeamMember = TeamGroup._meta.get_field('members').related_model
+
+OPTION_PRODUCT_FIELD = Product._meta.get_field('options').field
+PRICE_OPTION_FIELD = ProductOption._meta.get_field('prices').field
+
+SHOWABLE_PRICE_CHUNK_SIZE = 500
+PRICE_VERSION_KEY = u'showcase:price_version'
+
+
+def showcase_cache_key(level, slug, language=None):
+    version = cache.get_or_set(SHOWCASE_VERSION_KEY, initial_showcase_version, None)
+    return _format_showcase_cache_key(level, version, slug, language)
+
+
+async def ashowcase_cache_key(level, slug, language=None):
+    version = await cache.aget_or_set(SHOWCASE_VERSION_KEY, initial_showcase_version, None)
+    return _format_showcase_cache_key(level, version, slug, language)
+
+
+def _format_showcase_cache_key(level, version, slug, language):
+    key = SHOWCASE_CACHE_KEY.format(level, version, slug)
+    return u'{}:{}'.format(key, language) if language else key
+
+
+def _count_showcase_metric(name, value=1):
+    key = SHOWCASE_METRICS_KEY.format(name)
+
+    if not cache.add(key, value, None):
+        try:
+            cache.incr(key, value)
+        except ValueError:
+            pass
+
+
+async def _acount_showcase_metric(name, value=1):
+    key = SHOWCASE_METRICS_KEY.format(name)
+
+    if not await cache.aadd(key, value, None):
+        try:
+            await cache.aincr(key, value)
+        except ValueError:
+            pass
+
+
+def showcase_cache_metrics():
+    """
+    Stale serves and background rebuild durations of the showcase caches
+    :return: dict
+    """
+    stale_serves = cache.get(SHOWCASE_METRICS_KEY.format(u'stale_serves'), 0)
+    rebuilds = cache.get(SHOWCASE_METRICS_KEY.format(u'rebuilds'), 0)
+    rebuild_ms = cache.get(SHOWCASE_METRICS_KEY.format(u'rebuild_ms'), 0)
+
+    return {
+        'stale_serves': stale_serves,
+        'rebuilds': rebuilds,
+        'avg_rebuild_ms': float(rebuild_ms) / rebuilds if rebuilds else 0.0
+    }
+
+
+def read_cached(cache_key):
+    """
+    Stale-while-revalidate read
+    :param cache_key:
+    :return: cached value or None and whether it has expired
+    """
+    entry = cache.get(cache_key)
+
+    if entry is None:
+        return None, False
+
+    expires_at, value = entry
+    stale = expires_at < time.time()
+
+    if stale:
+        _count_showcase_metric(u'stale_serves')
+
+    return value, stale
+
+
+async def aread_cached(cache_key):
+    """
+    Async read_cached
+    :param cache_key:
+    :return: cached value or None and whether it has expired
+    """
+    entry = await cache.aget(cache_key)
+
+    if entry is None:
+        return None, False
+
+    expires_at, value = entry
+    stale = expires_at < time.time()
+
+    if stale:
+        await _acount_showcase_metric(u'stale_serves')
+
+    return value, stale
+
+
+def store_cached(cache_key, value, timeout=SHOWCASE_CACHE_TIMEOUT):
+    cache.set(cache_key, (time.time() + timeout, value), timeout + SHOWCASE_STALE_TIMEOUT)
+
+
+async def astore_cached(cache_key, value, timeout=SHOWCASE_CACHE_TIMEOUT):
+    await cache.aset(cache_key, (time.time() + timeout, value), timeout + SHOWCASE_STALE_TIMEOUT)
+
+
+def rebuild_lock_key(cache_key):
+    return cache_key + u':lock'
+
+
+def build_missing(cache_key, build):
+    """
+    Build a missing entry under the rebuild lock, so an invalidation does not make
+    every worker build it. Workers that don't get the lock wait for the entry,
+    and build it without storing it after SHOWCASE_REBUILD_WAIT seconds
+    :param cache_key:
+    :param build: callable returning the new value
+    :return:
+    """
+    lock_key = rebuild_lock_key(cache_key)
+    deadline = time.monotonic() + SHOWCASE_REBUILD_WAIT
+
+    while not cache.add(lock_key, 1, SHOWCASE_REBUILD_LOCK_TIMEOUT):
+        if time.monotonic() > deadline:
+            return build()
+
+        time.sleep(SHOWCASE_REBUILD_POLL)
+        value, stale = read_cached(cache_key)
+
+        if value is not None:
+            return value
+
+    try:
+        value, stale = read_cached(cache_key)
+
+        if value is None:
+            value = build()
+            store_cached(cache_key, value)
+
+        return value
+    finally:
+        cache.delete(lock_key)
+
+
+async def abuild_missing(cache_key, abuild):
+    """
+    Async build_missing
+    :param cache_key:
+    :param abuild: coroutine function returning the new value
+    :return:
+    """
+    lock_key = rebuild_lock_key(cache_key)
+    deadline = time.monotonic() + SHOWCASE_REBUILD_WAIT
+
+    while not await cache.aadd(lock_key, 1, SHOWCASE_REBUILD_LOCK_TIMEOUT):
+        if time.monotonic() > deadline:
+            return await abuild()
+
+        await asyncio.sleep(SHOWCASE_REBUILD_POLL)
+        value, stale = await aread_cached(cache_key)
+
+        if value is not None:
+            return value
+
+    try:
+        value, stale = await aread_cached(cache_key)
+
+        if value is None:
+            value = await abuild()
+            await astore_cached(cache_key, value)
+
+        return value
+    finally:
+        await cache.adelete(lock_key)
+
+
+def refresh_in_background(cache_key, build):
+    """
+    Rebuild an expired entry in a thread, the cache lock makes sure only one worker does it
+    :param cache_key:
+    :param build: callable returning the new value
+    :return:
+    """
+    if cache.add(rebuild_lock_key(cache_key), 1, SHOWCASE_REBUILD_LOCK_TIMEOUT):
+        _rebuild_in_thread(cache_key, build)
+
+
+async def arefresh_in_background(cache_key, build):
+    """
+    Async refresh_in_background
+    :param cache_key:
+    :param build: callable returning the new value
+    :return:
+    """
+    if await cache.aadd(rebuild_lock_key(cache_key), 1, SHOWCASE_REBUILD_LOCK_TIMEOUT):
+        _rebuild_in_thread(cache_key, build)
+
+
+def _rebuild_in_thread(cache_key, build):
+    lock_key = rebuild_lock_key(cache_key)
+
+    def rebuild():
+        started = time.monotonic()
+
+        try:
+            store_cached(cache_key, build())
+            duration_ms = int((time.monotonic() - started) * 1000)
+            _count_showcase_metric(u'rebuilds')
+            _count_showcase_metric(u'rebuild_ms', duration_ms)
+            logger.info(u'Showcase cache %s rebuilt in %s ms', cache_key, duration_ms)
+        except Exception:
+            logger.exception(u'Showcase cache %s rebuild failed', cache_key)
+        finally:
+            cache.delete(lock_key)
+            connections.close_all()
+
+    threading.Thread(target=rebuild, daemon=True).start()
+
+
+def get_or_rebuild(cache_key, build):
+    """
+    Cached value, expired entries are served while they are rebuilt in the background,
+    missing ones are built by a single worker
+    :param cache_key:
+    :param build: callable returning the new value
+    :return:
+    """
+    value, stale = read_cached(cache_key)
+
+    if stale:
+        refresh_in_background(cache_key, build)
+
+    if value is None:
+        value = build_missing(cache_key, build)
+
+    return value
+
+
+async def aget_or_rebuild(cache_key, build, abuild):
+    """
+    Async get_or_rebuild, a missing value is built by abuild
+    :param cache_key:
+    :param build: callable returning the new value, used by the background refresh
+    :param abuild: coroutine function returning the new value
+    :return:
+    """
+    value, stale = await aread_cached(cache_key)
+
+    if stale:
+        await arefresh_in_background(cache_key, build)
+
+    if value is None:
+        value = await abuild_missing(cache_key, abuild)
+
+    return value
+
+
+def annotate_showable_prices(products):
+    """
+    Lowest price and the matching option's is_pack_or_lux for every product in one query
+    :param products: Product queryset
+    :return: annotated queryset
+    """
+    lowest_options = ProductOption.objects.filter(**{
+        OPTION_PRODUCT_FIELD.name: OuterRef('pk'),
+        'prices__base_rate': OuterRef('showable_price')
+    }).order_by('pk')
+
+    return products.annotate(
+        showable_price=Min('options__prices__base_rate'),
+        is_lux=Subquery(lowest_options.values('is_pack_or_lux')[:1])
+    )
+
+
+def recompute_showable_prices(product_ids):
+    """
+    Store the showable price of the given products
+    :param product_ids:
+    :return:
+    """
+    rows = [ProductShowablePrice(product_id=p.pk, showable_price=p.showable_price, is_lux=p.is_lux)
+            for p in annotate_showable_prices(Product.objects.filter(pk__in=product_ids))]
+
+    ProductShowablePrice.objects.bulk_create(rows, update_conflicts=True, unique_fields=['product'],
+                                             update_fields=['showable_price', 'is_lux'])
+
+
+def backfill_showable_prices(chunk_size=SHOWABLE_PRICE_CHUNK_SIZE):
+    """
+    Recompute the showable price of all products, chunk by chunk
+    :param chunk_size:
+    :return: number of products
+    """
+    last_id = 0
+    total = 0
+
+    while True:
+        product_ids = list(Product.objects.filter(pk__gt=last_id)
+                                          .order_by('pk')
+                                          .values_list('pk', flat=True)[:chunk_size])
+
+        if not product_ids:
+            return total
+
+        recompute_showable_prices(product_ids)
+        last_id = product_ids[-1]
+        total += len(product_ids)
+
+
+class PricingLRU(object):
+    """
+    Process-wide LRU of resolved pricing with a TTL, shared between requests
+    """
+
+    def __init__(self, maxsize=5000, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+
+            if item is None:
+                return None
+
+            if item[0] < time.monotonic():
+                del self._items[key]
+                return None
+
+            self._items.move_to_end(key)
+            return item[1]
+
+    def set(self, key, value):
+        with self._lock:
+            self._items[key] = (time.monotonic() + self.ttl, value)
+            self._items.move_to_end(key)
+
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+
+class PricingMemo(object):
+    """
+    Request-scoped (showable_price, is_lux) per product and price version,
+    so each product is priced at most once per request
+    """
+
+    def __init__(self, shared=None):
+        self.version = cache.get_or_set(PRICE_VERSION_KEY, 1, None)
+        self.shared = shared
+        self._items = {}
+
+    def get(self, product_id):
+        key = (product_id, self.version)
+        pricing = self._items.get(key)
+
+        if pricing is None and self.shared is not None:
+            pricing = self.shared.get(key)
+
+            if pricing is not None:
+                self._items[key] = pricing
+
+        return pricing
+
+    def set(self, product_id, pricing):
+        key = (product_id, self.version)
+        self._items[key] = pricing
+
+        if self.shared is not None:
+            self.shared.set(key, pricing)
+
+
+SHARED_PRICING = PricingLRU()
+
+
+def load_showcase_products(products):
+    """
+    Products with their denormalized pricing
+    :param products: Product queryset
+    :return: list of products
+    """
+    return list(products.select_related('showable'))
+
+
+def get_agent_ids():
+    """
+    Member ids of the agents group, cached until the membership changes
+    or for AGENT_IDS_CACHE_TIMEOUT
+    """
+    agent_ids = cache.get(AGENT_IDS_CACHE_KEY)
+
+    if agent_ids is None:
+        agents_group = TeamGroup.objects.filter(is_agent=True).first()
+        agent_ids = list(agents_group.members.values_list('pk', flat=True)) if agents_group else []
+        cache.set(AGENT_IDS_CACHE_KEY, agent_ids, AGENT_IDS_CACHE_TIMEOUT)
+
+    return agent_ids
+
+
+def sample_agents(count):
+    """
+    Random agents without ORDER BY random() over the whole members table
+    :param count:
+    :return: list of members
+    """
+    agent_ids = get_agent_ids()
+    agent_ids = random.sample(agent_ids, min(count, len(agent_ids)))
+    members = TeamMember.objects.in_bulk(agent_ids)
+
+    return [members[i] for i in agent_ids if i in members]
+
+
 class ShowcaseView(TemplateView):
+    """
+    Showcase page with a two-level cache:
+    the pricing-enriched product lists and the rendered page without the agents block.
+    Expired entries are served while a single worker rebuilds them.
+    showcase/showcase.html outputs {{ agents_block }}, agents are rendered by showcase/agents.html
+
+    The rendered page is cached per language for anonymous visitors without pending messages only,
+    the CSRF token is set per response. Authenticated visitors get the page rendered for them
+    """
     template_name = 'showcase/showcase.html'
+    agents_template_name = 'showcase/agents.html'
+
+    # cross-request pricing memo, None keeps it request-scoped only
+    shared_pricing = SHARED_PRICING
+
+    @cached_property
+    def pricing_memo(self):
+        return PricingMemo(self.shared_pricing)
+
+    def get(self, request, *args, **kwargs):
+        if self.kwargs.get('option_slug', None):
+            raise Http404
+
+        if self.is_page_cacheable(request):
+            language = get_language()
+            content = get_or_rebuild(showcase_cache_key(u'html', self.kwargs.get('slug'), language),
+                                     lambda: self.render_content(language, **kwargs))
+        else:
+            content = self.render_content(**kwargs)
+
+        agents_block = render_to_string(self.agents_template_name, {'agents': self.get_agents()}, request)
+        return HttpResponse(self.finalize_content(request, content, agents_block))
+
+    def is_page_cacheable(self, request):
+        """
+        Only pages without user-specific content are shared between visitors
+        :param request:
+        :return: bool
+        """
+        return not request.user.is_authenticated and not get_messages(request)
+
+    def finalize_content(self, request, content, agents_block):
+        return content.replace(AGENTS_PLACEHOLDER, agents_block).replace(CSRF_TOKEN_PLACEHOLDER,
+                                                                         get_token(request))
+
+    def render_content(self, language=None, **kwargs):
+        """
+        Showcase page without the agents block and the CSRF token
+        :param language: rendered in this language, background rebuilds have no active one
+        """
+        with translation.override(language or get_language()):
+            context = self.get_context_data(**kwargs)
+            # safe, an escaped placeholder is not found by finalize_content()
+            context['agents_block'] = mark_safe(AGENTS_PLACEHOLDER)
+            context['csrf_token'] = CSRF_TOKEN_PLACEHOLDER
+            return self.render_to_response(context).rendered_content
 
     def get_context_data(self, *args, **kwargs):
         context = super().get_context_data(*args, **kwargs)
-        slug = self.kwargs.get('slug')
+        context.update(self.get_showcase_data(self.kwargs.get('slug')))
+        return context
+
+    def get_showcase_data(self, slug):
+        """
+        Showcase page with its products, cached per slug
+        :param slug:
+        :return: dict
+        """
+        return get_or_rebuild(showcase_cache_key(u'products', slug),
+                              lambda: self.build_showcase_data(slug))
+
+    def build_showcase_data(self, slug):
         showcase_page = ShowcasePage.objects.filter(slug=slug, is_active=True).first()
 
-        if not showcase_page or self.kwargs.get('option_slug', None):
+        if not showcase_page:
             raise Http404
 
-        context['showcase_page'] = showcase_page
-        context['products'] = [self.set_showable_price(p) for p in showcase_page.products.all()]
-        context['similar_products'] = [self.set_showable_price(p) for p in showcase_page.similar_tours.all()]
+        return {
+            'showcase_page': showcase_page,
+            'products': self.with_showable_prices(showcase_page.products.all()),
+            'similar_products': self.with_showable_prices(showcase_page.similar_tours.all())
+        }
+
+    def get_agents(self):
+        return sample_agents(3)
+
+    def with_showable_prices(self, products):
+        """
+        Set showable_price and is_lux from the pricing memo or the denormalized pricing,
+        products without a stored row are resolved in one batched query
+        :param products: Product queryset
+        :return: list of products
+        """
+        return self.set_showable_prices(load_showcase_products(products))
+
+    def set_showable_prices(self, products):
+        """
+        with_showable_prices for loaded products
+        :param products: list of products loaded by load_showcase_products()
+        :return: list of products
+        """
+        missing = [p.pk for p in products
+                   if self.pricing_memo.get(p.pk) is None and not hasattr(p, 'showable')]
+        resolved = annotate_showable_prices(Product.objects.filter(pk__in=missing)).in_bulk() if missing else {}
+
+        for product in products:
+            pricing = self.pricing_memo.get(product.pk)
+
+            if pricing is None:
+                row = resolved.get(product.pk) or product.showable
+                pricing = (row.showable_price, row.is_lux)
+                self.pricing_memo.set(product.pk, pricing)
+
+            product.showable_price, product.is_lux = pricing
+
+        return products
+
+
+class AsyncShowcaseView(ShowcaseView):
+    """
+    ShowcaseView for ASGI. Once the ShowcasePage is resolved, the products,
+    the similar tours and the agents are loaded concurrently.
+    Same caches and template contract as ShowcaseView
+    """
+
+    async def get(self, request, *args, **kwargs):
+        if self.kwargs.get('option_slug', None):
+            raise Http404
+
+        agents = asyncio.ensure_future(in_worker(self.get_agents)())
+
+        try:
+            if await sync_to_async(self.is_page_cacheable)(request):
+                language = get_language()
+                content = await aget_or_rebuild(
+                    await ashowcase_cache_key(u'html', self.kwargs.get('slug'), language),
+                    lambda: self.render_content(language, **kwargs),
+                    lambda: self.arender_content(**kwargs))
+            else:
+                content = await self.arender_content(**kwargs)
+        except BaseException:
+            # Http404 or a failed build, nobody awaits the agents
+            agents.cancel()
+            raise
+
+        agents_block = await sync_to_async(render_to_string)(self.agents_template_name, {'agents': await agents},
+                                                             request)
+        return HttpResponse(self.finalize_content(request, content, agents_block))
+
+    async def arender_content(self, **kwargs):
+        context = super(ShowcaseView, self).get_context_data(**kwargs)
+        context.update(await self.aget_showcase_data(self.kwargs.get('slug')))
+        context['agents_block'] = mark_safe(AGENTS_PLACEHOLDER)
+        context['csrf_token'] = CSRF_TOKEN_PLACEHOLDER
+
+        return await sync_to_async(lambda: self.render_to_response(context).rendered_content)()
+
+    async def aget_showcase_data(self, slug):
+        """
+        Async get_showcase_data
+        :param slug:
+        :return: dict
+        """
+        return await aget_or_rebuild(await ashowcase_cache_key(u'products', slug),
+                                     lambda: self.build_showcase_data(slug),
+                                     lambda: self.abuild_showcase_data(slug))
+
+    async def abuild_showcase_data(self, slug):
+        """
+        Async build_showcase_data, both product lists are queried at the same time.
+        They are priced together in one worker, the pricing memo is not shared between threads
+        :param slug:
+        :return: dict
+        """
+        showcase_page = await ShowcasePage.objects.filter(slug=slug, is_active=True).afirst()
+
+        if not showcase_page:
+            raise Http404
+
+        load_products = in_worker(load_showcase_products)
+        products, similar_products = await asyncio.gather(
+            load_products(showcase_page.products.all()),
+            load_products(showcase_page.similar_tours.all())
+        )
+
+        await in_worker(self.set_showable_prices)(products + similar_products)
+
+        return {
+            'showcase_page': showcase_page,
+            'products': products,
+            'similar_products': similar_products
+        }
+
+
+def initial_showcase_version():
+    # an evicted version restarts from the clock, not from 1, so the entries kept
+    # for SHOWCASE_STALE_TIMEOUT under the earlier versions are not served again
+    return int(time.time())
+
+
+def bump_showcase_version():
+    if not cache.add(SHOWCASE_VERSION_KEY, initial_showcase_version(), None):
+        try:
+            cache.incr(SHOWCASE_VERSION_KEY)
+        except ValueError:
+            pass
+
+
+def invalidate_showcases(**kwargs):
+    """
+    Showcase content changes rarely, any change drops every cached showcase.
+    The version is bumped after commit, a rebuild before it would cache the old content.
+    Option and price changes bump it in ShowablePriceRecompute
+    """
+    transaction.on_commit(bump_showcase_version)
+
+
+for model in (ShowcasePage, Product):
+    post_save.connect(invalidate_showcases, sender=model, dispatch_uid='invalidate_showcases')
+    post_delete.connect(invalidate_showcases, sender=model, dispatch_uid='invalidate_showcases')
+
+for through in (ShowcasePage.products.through, ShowcasePage.similar_tours.through):
+    m2m_changed.connect(invalidate_showcases, sender=through, dispatch_uid='invalidate_showcases')
+
+
+def drop_agent_ids():
+    cache.delete(AGENT_IDS_CACHE_KEY)
+
+
+def invalidate_agent_ids(**kwargs):
+    """
+    Dropped after commit, like invalidate_showcases,
+    a request before it would cache the old membership again
+    """
+    transaction.on_commit(drop_agent_ids)
+
+
+for model in (TeamGroup, TeamMember):
+    post_save.connect(invalidate_agent_ids, sender=model, dispatch_uid='invalidate_agent_ids')
+    post_delete.connect(invalidate_agent_ids, sender=model, dispatch_uid='invalidate_agent_ids')
+
+m2m_changed.connect(invalidate_agent_ids, sender=TeamGroup.members.through, dispatch_uid='invalidate_agent_ids')
+
+
+def bump_price_version():
+    if not cache.add(PRICE_VERSION_KEY, 1, None):
+        try:
+            cache.incr(PRICE_VERSION_KEY)
+        except ValueError:
+            pass
+
+
+class ShowablePriceRecompute(object):
+    """
+    Products and options changed in a transaction. Called once after the commit,
+    recomputes their products, then drops the memoized pricing and the showcases once
+    """
+
+    def __init__(self):
+        self.product_ids = set()
+        self.option_ids = set()
+
+    def __call__(self):
+        product_ids = set(self.product_ids)
+
+        if self.option_ids:
+            product_ids.update(ProductOption.objects.filter(pk__in=self.option_ids)
+                                                    .values_list(OPTION_PRODUCT_FIELD.attname, flat=True))
+
+        product_ids.discard(None)
+
+        if product_ids:
+            recompute_showable_prices(product_ids)
+            bump_price_version()
+            bump_showcase_version()
+
+
+def schedule_showable_price_recompute(product_id=None, option_id=None):
+    """
+    Add the product or option to the recompute of the current transaction,
+    so that rebuilds read the new ProductShowablePrice row.
+    The recompute is scheduled with the first change; a savepoint rollback discards it
+    with its changes and the next change schedules a new one
+    :param product_id:
+    :param option_id:
+    :return:
+    """
+    connection = transaction.get_connection()
+    recompute = next((entry[1] for entry in connection.run_on_commit
+                      if isinstance(entry[1], ShowablePriceRecompute)), None)
+    scheduled = recompute is not None
+
+    if not scheduled:
+        recompute = ShowablePriceRecompute()
+
+    if product_id:
+        recompute.product_ids.add(product_id)
+
+    if option_id:
+        recompute.option_ids.add(option_id)
+
+    # outside a transaction on_commit calls it right away, the ids are added first
+    if not scheduled:
+        transaction.on_commit(recompute)
+
+
+def option_changed(sender, instance, **kwargs):
+    schedule_showable_price_recompute(product_id=getattr(instance, OPTION_PRODUCT_FIELD.attname))
+
+
+def price_changed(sender, instance, **kwargs):
+    schedule_showable_price_recompute(option_id=getattr(instance, PRICE_OPTION_FIELD.attname))
 
-        agents_group = TeamGroup.objects.filter(is_agent=True).first()
-        context['agents'] = agents_group.members.order_by('?')[:3]
-        return context
 
-    def set_showable_price(self, product):
-        product.showable_price = product.lowest_price
-        lowest = product.options.filter(prices__base_rate=product.showable_price).first()
-        product.is_lux = lowest.is_pack_or_lux if lowest else None
-        return product
+for signal in (post_save, post_delete):
+    signal.connect(option_changed, sender=ProductOption, dispatch_uid='showable_price_option_changed')
+    signal.connect(price_changed, sender=ProductPrice, dispatch_uid='showable_price_price_changed')
@@ -1,8 +1,92 @@
+CONCURRENT_STATUSES = ["scheduled", "present", "modified"]
+
+# classes of the teacher or in the room overlapping any of the weekly slots,
+# the first one with the total count. One branch per index, the room branch skips
+# the teacher classes so that a class is counted once
+CONCURRENCES_SQL = """
+WITH slots AS (
+    SELECT tsrange(day + %(start_time)s::time, day + %(end_time)s::time) AS time_range
+    FROM (SELECT %(class_date)s::date + week * 7 AS day
+          FROM generate_series(0, %(weeks)s - 1) AS week) AS days
+),
+concurrences AS (
+    SELECT c.*, TRUE AS teacher_conflict
+    FROM slots s
+    JOIN {table} c ON c.{staff} = %(staff)s
+    AND tsrange(c.class_date + c.start_time, c.class_date + c.end_time) && s.time_range
+    WHERE c.class_status = ANY(%(statuses)s)
+    AND c.{class_id} <> %(class_id)s
+
+    UNION ALL
+
+    SELECT c.*, FALSE AS teacher_conflict
+    FROM slots s
+    JOIN {table} c ON c.{room} = %(room)s
+    AND tsrange(c.class_date + c.start_time, c.class_date + c.end_time) && s.time_range
+    WHERE c.class_status = ANY(%(statuses)s)
+    AND c.{class_id} <> %(class_id)s
+    AND c.{staff} IS DISTINCT FROM %(staff)s
+)
+SELECT *, COUNT(*) OVER () AS total_count
+FROM concurrences
+ORDER BY class_date, teacher_conflict DESC
+LIMIT 1
+"""
+
+
+def find_concurrences(class_instance, staff_id, room_id, class_date, weeks, start_time, end_time):
+    """
+    Classes of the teacher or in the room intersecting by the time with the weekly slots, in one query.
+    Backed by the ClassRolloutDetailView docstring indexes, so the cost grows
+    with the number of slots and not with the number of scheduled classes
+    :param class_instance: changed class rollout, its class is ignored
+    :param staff_id:
+    :param room_id:
+    :param class_date: date of the first slot
+    :param weeks: number of weekly slots
+    :param start_time:
+    :param end_time:
+    :return: number of concurrent classes and the first of them
+    """
+    sql = CONCURRENCES_SQL.format(table=ClassRollout._meta.db_table,
+                                  staff=ClassRollout._meta.get_field('staff').column,
+                                  room=ClassRollout._meta.get_field('room').column,
+                                  class_id=ClassRollout._meta.get_field('class_id').column)
+
+    concurrences = list(ClassRollout.objects.raw(sql, {
+        'weeks': weeks,
+        'class_date': class_date,
+        'staff': staff_id,
+        'room': room_id,
+        'statuses': CONCURRENT_STATUSES,
+        'class_id': class_instance.class_id_id,
+        'start_time': start_time,
+        'end_time': end_time
+    }))
+
+    if not concurrences:
+        return 0, None
+
+    return concurrences[0].total_count, concurrences[0]
+
+
 class ClassRolloutDetailView(mixins.RetrieveModelMixin,
                              mixins.UpdateModelMixin,
                              mixins.DestroyModelMixin,
                              generics.GenericAPIView):
-    queryset = ClassRollout.objects.all()
+    """
+    Teacher and room conflicts are checked by find_concurrences(),
+    backed by the GiST indexes of classes/migrations/0004_classrollout_schedule_indexes.py:
+
+    CREATE EXTENSION IF NOT EXISTS btree_gist;
+
+    CREATE INDEX classrollout_staff_time ON classes_classrollout
+    USING gist (staff_id, tsrange(class_date + start_time, class_date + end_time));
+
+    CREATE INDEX classrollout_room_time ON classes_classrollout
+    USING gist (room_id, tsrange(class_date + start_time, class_date + end_time));
+    """
+    queryset = ClassRollout.objects.select_related(*ROLLOUT_RELATED)
     permission_classes = (AllowAny,)
     serializer_class = ClassRolloutSerializer
 
@@ -45,20 +129,21 @@ class ClassRolloutDetailView(mixins.RetrieveModelMixin,
         if permanently:
             instances = class_instance.class_id\
                                       .class_rollout\
+                                      .select_related(*ROLLOUT_RELATED)\
                                       .filter(class_date__gte=class_instance.class_date)\
                                       .order_by('class_date')
 
-        for inst in instances:
-            self.create_log(inst)
-            self.cancel_class(inst, reason, permanently)
+        with transaction.atomic():
+            instances = list(instances)
+            self.create_logs(instances)
+            self.cancel_classes(instances, reason, permanently)
 
-        # update google calendar events
-        self.async_change_gc([self.delete_gc_event(instance) for instance in instances])
+            # update google calendar events
+            self.enqueue(RolloutOutbox.DELETE_GC_EVENT, instances)
 
-        # send teacher notification
-        class_instance.send_delete_event_notification_email(
-            class_instance, email_date, user=self.request.user.staff.full_name
-        )
+            # send teacher notification
+            self.enqueue(RolloutOutbox.DELETE_EMAIL, [class_instance],
+                         email_date=email_date, user=self.request.user.staff.full_name)
 
     def update(self, request, *args, **kwargs):
         instance = self.get_object()
@@ -84,89 +169,52 @@ class ClassRolloutDetailView(mixins.RetrieveModelMixin,
         flag_student_break = self.request.data.get('break_flag', False)
         flag_student_discontinued = self.request.data.get('discontinuation_flag', False)
 
-        if flag_student_cancel:
-            self.student_cancellation(class_instance)
-            
-        elif flag_student_revert:
-            self.student_revert(class_instance)
-            
-        elif flag_student_restore_in_class:
-            instances, student_instances = self.restore_break_process(class_instance)
-            
-        elif flag_student_break:
-            instances, student_instances = self.break_process(class_instance)
-            
-        elif flag_student_discontinued:
-            instances, student_instances = self.discontinuation_process(class_instance)
-
-        else:
-            instances, concurrences_data = self.regular_update(class_instance)
-
-        if not instances:
-            return Response(concurrences_data)
-
-        # update google calendar
-        update_events = [self.update_gc_event(instance) for instance in instances]
-
-        if student_instances:
-            update_student_events = [self.update_parent_gc_event(instance) for instance in student_instances]
-            update_events += update_student_events
-
-        self.async_change_gc(update_events)
-
-        # send teacher notification
-        class_instance.send_change_event_notification_email(
-            class_instance, len(instances), user=self.request.user.staff.full_name
-        )
-
-        return Response(serializer.data)
-
-    def async_change_gc(self, tasks):
-        """
-        Change google calendar events
-        :param tasks: list of task
-        :return:
-        """
-        event_loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(event_loop)
-
-        wait_tasks = asyncio.wait(tasks, return_when='FIRST_COMPLETED')
-
-        event_loop.run_until_complete(wait_tasks)
-        event_loop.close()
-
-    async def update_gc_event(self, inst):
-        """
-        Update google calendar event
-        :param inst:
-        :return:
-        """
-        prepare_data_and_update_event(
-            inst.gc_event_id, inst.location.calendarId,
-            event_name=inst.gc_title,
-            description=inst.gc_event_description,
-            attendees=inst.gc_event_attendees,
-            start_date=inst.class_date,
-            start_time=inst.start_time,
-            end_time=inst.end_time,
-        )
-
-    async def update_parent_gc_event(self, student_in_class):
+        with transaction.atomic():
+            if flag_student_cancel:
+                self.student_cancellation(class_instance)
+                
+            elif flag_student_revert:
+                self.student_revert(class_instance)
+                
+            elif flag_student_restore_in_class:
+                instances, student_instances = self.restore_break_process(class_instance)
+                
+            elif flag_student_break:
+                instances, student_instances = self.break_process(class_instance)
+                
+            elif flag_student_discontinued:
+                instances, student_instances = self.discontinuation_process(class_instance)
+
+            else:
+                instances, concurrences_data = self.regular_update(class_instance)
+
+            if not instances:
+                return Response(concurrences_data)
+
+            # update google calendar
+            self.enqueue(RolloutOutbox.UPDATE_GC_EVENT, instances)
+
+            if student_instances:
+                self.enqueue(RolloutOutbox.UPDATE_PARENT_GC_EVENT,
+                             [inst for inst in student_instances if inst.gc_parent_event_id])
+
+            # send teacher notification
+            self.enqueue(RolloutOutbox.CHANGE_EMAIL, [class_instance],
+                         count=len(instances), user=self.request.user.staff.full_name)
+
+            return Response(serializer.data)
+
+    def enqueue(self, kind, objects, **payload):
         """
-        Update google calendar event
-        :param student_in_class:
+        Queue a calendar update or email, delivered by drain_rollout_outbox()
+        :param kind: RolloutOutbox kind
+        :param objects: class rollouts or StudentInClass instances
+        :param payload:
         :return:
         """
-        if student_in_class.gc_parent_event_id:
-            prepare_data_and_update_event(
-                student_in_class.gc_parent_event_id,
-                student_in_class.class_id.location.parent_calendarId,
-                event_name=student_in_class.gc_parent_title,
-                description=student_in_class.gc_parent_event_description
-            )
-
-    async def delete_gc_event(self, inst):
-        delete_gcalendar_event(inst.location.calendarId, inst.gc_event_id)
+        RolloutOutbox.objects.bulk_create([
+            RolloutOutbox(kind=kind, object_id=obj.pk, payload=payload) for obj in objects
+        ])
 
     def student_cancellation(self, inst):
         """
@@ -185,7 +233,7 @@ class ClassRolloutDetailView(mixins.RetrieveModelMixin,
 
             self.create_student_log(student_in_class)
 
-            self.async_change_gc([self.update_parent_gc_event(student_in_class)])
+            self.enqueue(RolloutOutbox.UPDATE_PARENT_GC_EVENT, [student_in_class])
 
     def student_revert(self, inst):
         """
@@ -217,7 +265,7 @@ class ClassRolloutDetailView(mixins.RetrieveModelMixin,
                 )
 
             self.create_student_log(student_in_class)
-            self.async_change_gc([self.update_parent_gc_event(student_in_class)])
+            self.enqueue(RolloutOutbox.UPDATE_PARENT_GC_EVENT, [student_in_class])
 
     def discontinuation_process(self, class_instance):
         effective_date = convert_to_date(self.request.data.get('date', None))
@@ -253,13 +301,24 @@ class ClassRolloutDetailView(mixins.RetrieveModelMixin,
             class_id__id__in=instances.values_list('id', flat=True),
             student__id=student_id)
 
-        student_instances.update(
+        # the "on break till" text is read from the period, see StudentInClass.break_status_comments
+        student_break = StudentBreak.objects.create(
+            student_id=student_id,
+            start_date=start_date,
+            end_date=end_date,
+            reason=reason or '')
+
+        updated = student_instances.update(
             status='break',
             comments=reason,
-            status_comments="on break till {}".format(end_date.strftime("%b %d, %Y")),
+            break_period=student_break,
             last_class=F('class_id'),
             class_id=None)
 
+        # no classes of the student in the dates, the period would have no rows
+        if not updated:
+            student_break.delete()
+
         return instances, student_instances
 
     def restore_break_process(self, class_instance):
@@ -278,33 +337,55 @@ class ClassRolloutDetailView(mixins.RetrieveModelMixin,
             student__id=student_id,
             status__in=statuses)
 
-        if student_instances.filter(status='break').count():
-            comments = student_instances.filter(status='break').values_list(
-                'status_comments', flat=True
-            ).distinct()
-
-            for comment in comments:
-                break_students_chain = StudentInClass.objects\
-                                                     .filter(status_comments=comment)\
-                                                     .exclude(last_class__class_date__gte=start_date,
-                                                              last_class__class_date__lte=end_date)\
-                                                     .order_by('last_class__class_date')
-
-                if break_students_chain.count():
-                    last_break = break_students_chain.last()
-                    break_students_chain.update(status_comments="on break till {}".format(
-                        last_break.last_class.class_date.strftime("%b %d, %Y"))
-                    )
+        break_ids = list(student_instances.filter(status='break', break_period__isnull=False)
+                                          .values_list('break_period', flat=True)
+                                          .distinct())
 
         student_instances.update(
             status='scheduled',
             comments='',
             status_comments="",
+            break_period=None,
             class_id=F('last_class'),
             last_class=None)
 
+        self.shrink_breaks(break_ids, start_date, end_date)
+
         return instances, student_instances
 
+    def shrink_breaks(self, break_ids, start_date, end_date):
+        """
+        Delete the break periods without rows on break left,
+        the ones restored at the head or the tail start or end with their remaining classes.
+        A restore in the middle changes neither date and writes nothing,
+        one at the tail only saves the end date, the rows read their "on break till" text from it
+        :param break_ids: periods the restored rows belonged to
+        :param start_date: restored dates
+        :param end_date:
+        :return:
+        """
+        student_breaks = StudentBreak.objects.filter(id__in=break_ids).annotate(
+            first_date=Min('student_instances__last_class__class_date'),
+            last_date=Max('student_instances__last_class__class_date'))
+
+        for student_break in student_breaks:
+            if student_break.first_date is None:
+                student_break.delete()
+                continue
+
+            changed_fields = []
+
+            if start_date <= student_break.start_date and student_break.first_date != student_break.start_date:
+                student_break.start_date = student_break.first_date
+                changed_fields.append('start_date')
+
+            if end_date >= student_break.end_date and student_break.last_date != student_break.end_date:
+                student_break.end_date = student_break.last_date
+                changed_fields.append('end_date')
+
+            if changed_fields:
+                student_break.save(update_fields=changed_fields)
+
     def regular_update(self, class_instance):
         """
         Regular update class rollout instance
@@ -324,15 +405,13 @@ class ClassRolloutDetailView(mixins.RetrieveModelMixin,
         start_time = get_time(self.request.data.get('start_time', None))
         end_time = get_time(self.request.data.get('end_time', None))
 
-        room = Room.objects.filter(id=room_id).first()
-        subject = Subject.objects.filter(id=subject_id).first()
-        staff = Staff.objects.filter(id=teacher_id).first()
-        duration = ClassDuration.objects.filter(id=duration_id).first()
+        room = self.resolve_related(class_instance, 'room', Room, room_id)
+        subject = self.resolve_related(class_instance, 'subject', Subject, subject_id)
+        staff = self.resolve_related(class_instance, 'staff', Staff, teacher_id)
+        duration = self.resolve_related(class_instance, 'duration', ClassDuration, duration_id)
 
         concurrences_data = {}
         instances = [class_instance]
-        class_dates = [class_date]
-        statuses = ["scheduled", "present", "modified"]
 
         new_instances_params = {
             'max_students': max_students,
@@ -347,85 +426,106 @@ class ClassRolloutDetailView(mixins.RetrieveModelMixin,
 
         # if 'permanently' get all class instances after chosen class
         if permanently:
-            instances = class_instance.class_id\
-                                      .class_rollout\
-                                      .filter(class_date__gte=effective_date)\
-                                      .order_by('class_date')
-
-            for i in range(1, instances.count()):
-                class_dates.append(class_dates[-1] + timedelta(weeks=1))
+            instances = list(class_instance.class_id
+                                           .class_rollout
+                                           .select_related(*ROLLOUT_RELATED)
+                                           .filter(class_date__gte=effective_date)
+                                           .order_by('class_date'))
 
         # find classes intersecting by the time
-        concurrences = ClassRollout.objects \
-                                   .filter(class_date__in=class_dates, staff=teacher_id, class_status__in=statuses)\
-                                   .filter(~Q(class_id=class_instance.class_id))\
-                                   .filter(Q(start_time__lte=start_time, end_time__gt=start_time) |
-                                           Q(start_time__gt=end_time, end_time__lte=end_time,))\
-                                   .order_by('class_date')
-
-        if concurrences.count():
+        concurrences_count, concurrent_class = find_concurrences(
+            class_instance, teacher_id, room_id, class_date, len(instances), start_time, end_time
+        )
+
+        if concurrences_count:
             instances = []
-            concurrent_class = concurrences.first()
             concurrences_data = {
                 'unmodified': True,
-                'count': concurrences.count(),
-                'message': 'Teacher already has a class at this time. Please check info below:',
+                'count': concurrences_count,
+                'message': 'Teacher already has a class at this time. Please check info below:'
+                           if concurrent_class.teacher_conflict else
+                           'Room is already booked at this time. Please check info below:',
                 'class': {
                     'date': concurrent_class.class_date,
                     'start_time': concurrent_class.start_time,
                     'end_time': concurrent_class.end_time,
-                    'room': concurrent_class.room.room_name,
-                    'teacher': concurrent_class.staff.full_name,
-                    'subject': concurrent_class.subject.name
+                    'room': concurrent_class.room.room_name if concurrent_class.room else None,
+                    'teacher': concurrent_class.staff.full_name if concurrent_class.staff else None,
+                    'subject': concurrent_class.subject.name if concurrent_class.subject else None
                 }
             }
 
-        for inst in instances:
-            self.create_log(inst)
-            self.change_instance(inst, new_instances_params)
-
-            # for the permanently changes. event date every week
-            new_instances_params['class_date'] += timedelta(weeks=1)
+        self.create_logs(instances)
+        self.change_instances(instances, new_instances_params)
 
         return instances, concurrences_data
 
-    def cancel_class(self, inst, reason, permanently):
+    def resolve_related(self, inst, field, model, pk):
         """
-        Cancel class rollout class and all studentInClass instances
-        :param inst:
+        Related object by id, reused from the instance when the id doesn't change
+        :param inst: class rollout with the relations joined
+        :param field:
+        :param model:
+        :param pk: requested id
+        :return:
+        """
+        if pk is not None and str(getattr(inst, field + '_id')) == str(pk):
+            return getattr(inst, field)
+
+        return model.objects.filter(id=pk).first()
+
+    def cancel_classes(self, instances, reason, permanently):
+        """
+        Cancel class rollouts and all their studentInClass instances.
+        Two UPDATE statements however many classes are cancelled
+        :param instances: list of class rollouts
         :param reason:
-        :param status:
+        :param permanently:
         :return:
         """
-        inst.class_status = 'cancelled'
-        inst.comments = reason
-        inst.show_while_cancelled = not permanently
-        inst.save()
+        for inst in instances:
+            inst.class_status = 'cancelled'
+            inst.comments = reason
+            inst.show_while_cancelled = not permanently
 
-        for student_in_class in inst.students.all():
-            student_in_class.status = 'cancelled'
-            student_in_class.last_class = student_in_class.class_id
-            student_in_class.class_id = None
-            student_in_class.save()
+        ClassRollout.objects.filter(id__in=[inst.id for inst in instances])\
+                            .update(class_status='cancelled',
+                                    comments=reason,
+                                    show_while_cancelled=not permanently)
 
-    def change_instance(self, inst, params):
+        StudentInClass.objects.filter(class_id__in=[inst.id for inst in instances])\
+                              .update(status='cancelled',
+                                      last_class=F('class_id'),
+                                      class_id=None)
+
+    def change_instances(self, instances, params):
         """
-        Changed the class rollout instance
-        :param inst:
+        Changed the class rollout instances, the class date moves a week for every next instance
+        :param instances: list of class rollouts ordered by class date
         :param params:
         :return:
         """
-        inst.class_date = params['class_date']
-        inst.start_time = params['start_time']
-        inst.end_time = params['end_time']
-        inst.max_capacity = params['max_students']
-        inst.room = params['room']
-        inst.subject = params['subject']
-        inst.staff = params['teacher']
-        inst.duration = params['duration']
-        inst.gc_event_title = inst.gc_title
-        inst.class_status = 'modified'
-        inst.save()
+        class_date = params['class_date']
+
+        for inst in instances:
+            inst.class_date = class_date
+            inst.start_time = params['start_time']
+            inst.end_time = params['end_time']
+            inst.max_capacity = params['max_students']
+            inst.room = params['room']
+            inst.subject = params['subject']
+            inst.staff = params['teacher']
+            inst.duration = params['duration']
+            inst.gc_event_title = inst.gc_title
+            inst.class_status = 'modified'
+
+            # for the permanently changes. event date every week
+            class_date += timedelta(weeks=1)
+
+        ClassRollout.objects.bulk_update(instances, [
+            'class_date', 'start_time', 'end_time', 'max_capacity', 'room', 'subject',
+            'staff', 'duration', 'gc_event_title', 'class_status'
+        ])
 
     def create_student_log(self, inst):
         """
@@ -440,12 +540,20 @@ class ClassRolloutDetailView(mixins.RetrieveModelMixin,
         student_log.status = inst.status
         student_log.save()
 
-    def create_log(self, inst):
+    def create_logs(self, instances):
         """
-        Create log for the Class Rollout
-        :param inst:
+        Create logs for the Class Rollouts in one INSERT
+        :param instances:
         :return:
         """
+        ClassRolloutLog.objects.bulk_create([self.build_log(inst) for inst in instances])
+
+    def build_log(self, inst):
+        """
+        Unsaved log for the Class Rollout
+        :param inst:
+        :return: ClassRolloutLog
+        """
         log = ClassRolloutLog()
         log.modification_date = timezone.now()
         log.modification_object = inst
@@ -472,4 +580,4 @@ class ClassRolloutDetailView(mixins.RetrieveModelMixin,
         log.gc_event_id = inst.gc_event_id
         log.gc_event_title = inst.gc_event_title
 
-        log.save()
+        return log
@@ -0,0 +1,107 @@
+class QueryStats(object):
+    """
+    Query count, total SQL time and the slowest statement of a request.
+    Installed with connection.execute_wrapper()
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.sql_time = 0.0
+        self.slowest_time = 0.0
+        self.slowest_sql = None
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.monotonic()
+
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.monotonic() - started
+            self.count += 1
+            self.sql_time += duration
+
+            if duration > self.slowest_time:
+                self.slowest_time = duration
+                self.slowest_sql = sql
+
+
+def log_sink(record):
+    logger.info(u'%(view)s.%(method)s: %(queries)s queries, %(sql_ms)s ms SQL, %(wall_ms)s ms total',
+                record)
+
+
+class QueryInstrumentationMiddleware(object):
+    """
+    Sampled per-view query count, SQL time, slowest statement and wall time.
+
+    settings.QUERY_INSTRUMENTATION = {
+        'sample_rate': 0.01,
+        'sink': 'path.to.callable',  # receives the record dict, log_sink by default
+        'budgets': {
+            'ShowcaseView': {'queries': 10, 'sql_ms': 100, 'wall_ms': 300},
+        },
+    }
+
+    Only the request thread connection is wrapped, queries that async views
+    run in worker threads are not counted.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+        config = getattr(settings, 'QUERY_INSTRUMENTATION', {})
+        self.sample_rate = config.get('sample_rate', 0.01)
+        self.sink = import_string(config['sink']) if config.get('sink') else log_sink
+        self.budgets = config.get('budgets', {})
+
+    def __call__(self, request):
+        if random.random() >= self.sample_rate:
+            return self.get_response(request)
+
+        stats = QueryStats()
+        started = time.monotonic()
+
+        with connection.execute_wrapper(stats):
+            response = self.get_response(request)
+
+        record = {
+            'view': getattr(request, '_instrumented_view', None),
+            'method': request.method.lower(),
+            'path': request.path,
+            'queries': stats.count,
+            'sql_ms': int(stats.sql_time * 1000),
+            'slowest_ms': int(stats.slowest_time * 1000),
+            'slowest_sql': stats.slowest_sql,
+            'wall_ms': int((time.monotonic() - started) * 1000)
+        }
+
+        # instrumentation never fails the request it measures
+        try:
+            self.check_budget(record)
+            self.sink(record)
+        except Exception:
+            logger.exception(u'Query instrumentation of %s.%s failed', record['view'], record['method'])
+
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        view = getattr(view_func, 'view_class', view_func)
+        request._instrumented_view = view.__name__
+
+    def check_budget(self, record):
+        """
+        Log the request when it goes over its view budget
+        :param record:
+        :return:
+        """
+        budget = self.budgets.get(record['view'])
+
+        if not budget:
+            return
+
+        exceeded = [name for name, limit in budget.items() if record.get(name, 0) > limit]
+
+        if exceeded:
+            logger.warning(u'%s.%s over budget (%s): %s queries, %s ms SQL, %s ms total, slowest: %s',
+                           record['view'], record['method'], ', '.join(exceeded), record['queries'],
+                           record['sql_ms'], record['wall_ms'], record['slowest_sql'])
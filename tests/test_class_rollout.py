@@ -0,0 +1,196 @@
+WRITE_STATEMENTS = ('INSERT', 'UPDATE', 'DELETE')
+
+
+def count_writes(queries):
+    return len([query for query in queries if query['sql'].lstrip().split(None, 1)[0].upper() in WRITE_STATEMENTS])
+
+
+class RolloutTestMixin(object):
+    """
+    Weekly rollouts of a class and a ClassRolloutDetailView with a request of a manager
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = baker.make(Staff)
+
+    def make_rollouts(self, weeks, students=3):
+        class_model = ClassRollout._meta.get_field('class_id').related_model
+        klass = baker.make(class_model)
+        first_date = date(2026, 1, 5)
+
+        rollouts = [baker.make(ClassRollout, class_id=klass, class_status='scheduled',
+                               class_date=first_date + timedelta(weeks=week),
+                               start_time=time(10), end_time=time(11))
+                    for week in range(weeks)]
+
+        for rollout in rollouts:
+            baker.make(StudentInClass, class_id=rollout, status='scheduled', _quantity=students)
+
+        return rollouts
+
+    def make_view(self, **data):
+        view = ClassRolloutDetailView()
+        view.request = SimpleNamespace(data=data, user=SimpleNamespace(staff=self.staff,
+                                                                        email='manager@example.com'))
+        return view
+
+
+class ClassRolloutWritesTest(RolloutTestMixin, TestCase):
+    """
+    Cancelling and permanently changing a class writes the same number of statements
+    however many weeks it spans
+    """
+
+    def test_permanent_cancellation_writes_are_constant(self):
+        for weeks in (3, 12):
+            with self.subTest(weeks=weeks):
+                rollouts = self.make_rollouts(weeks)
+                view = self.make_view(permanently=True, reason='Closed')
+
+                with CaptureQueriesContext(connection) as queries:
+                    view.perform_destroy(SimpleNamespace(instance=rollouts[0]))
+
+                # logs, rollouts, students, calendar messages, email message
+                self.assertEqual(count_writes(queries), 5)
+                self.assertFalse(StudentInClass.objects.filter(class_id__in=rollouts).exists())
+                self.assertEqual(ClassRollout.objects.filter(id__in=[r.id for r in rollouts],
+                                                             class_status='cancelled').count(), weeks)
+
+    def test_permanent_change_writes_are_constant(self):
+        for weeks in (3, 12):
+            with self.subTest(weeks=weeks):
+                rollouts = self.make_rollouts(weeks)
+                first = rollouts[0]
+                view = self.make_view(permanently=True,
+                                      max_students=10,
+                                      effective_date=first.class_date.strftime('%m/%d/%Y'),
+                                      class_date=first.class_date.strftime('%m/%d/%Y'),
+                                      start_time='12:00',
+                                      end_time='13:00',
+                                      room=first.room_id,
+                                      subject=first.subject_id,
+                                      teacher=first.staff_id,
+                                      duration=first.duration_id)
+
+                with CaptureQueriesContext(connection) as queries:
+                    instances, concurrences_data = view.regular_update(first)
+
+                # the conflict check reads, then logs and rollouts are written
+                self.assertEqual(concurrences_data, {})
+                self.assertEqual(len(instances), weeks)
+                self.assertEqual(count_writes(queries), 2)
+                self.assertEqual(ClassRollout.objects.filter(id__in=[r.id for r in rollouts],
+                                                             class_status='modified',
+                                                             start_time=time(12)).count(), weeks)
+
+
+class StudentBreakRestoreTest(RolloutTestMixin, TestCase):
+    """
+    Restoring part of a break only writes the period dates that move,
+    a break is only recorded for the classes it covers
+    """
+
+    def make_break(self, rollouts, restored):
+        student_break = baker.make(StudentBreak, start_date=rollouts[0].class_date,
+                                   end_date=rollouts[-1].class_date)
+
+        for rollout in rollouts:
+            if rollout not in restored:
+                baker.make(StudentInClass, student=student_break.student, status='break', class_id=None,
+                           last_class=rollout, break_period=student_break)
+
+        return student_break
+
+    def test_middle_restore_writes_nothing(self):
+        rollouts = self.make_rollouts(5, students=0)
+        student_break = self.make_break(rollouts, rollouts[2:3])
+
+        with CaptureQueriesContext(connection) as queries:
+            self.make_view().shrink_breaks([student_break.id], rollouts[2].class_date, rollouts[2].class_date)
+
+        self.assertEqual(count_writes(queries), 0)
+
+    def test_tail_restore_moves_the_end_date(self):
+        rollouts = self.make_rollouts(5, students=0)
+        student_break = self.make_break(rollouts, rollouts[3:])
+
+        with CaptureQueriesContext(connection) as queries:
+            self.make_view().shrink_breaks([student_break.id], rollouts[3].class_date, rollouts[4].class_date)
+
+        # the period only, its rows read the "on break till" text from it
+        self.assertEqual(count_writes(queries), 1)
+
+        student_break.refresh_from_db()
+        self.assertEqual(student_break.end_date, rollouts[2].class_date)
+        self.assertEqual(set(row.break_status_comments for row in
+                             student_break.student_instances.select_related('break_period')),
+                         {u'on break till {}'.format(rollouts[2].class_date.strftime('%b %d, %Y'))})
+
+    def test_break_without_classes_leaves_no_period(self):
+        rollouts = self.make_rollouts(3, students=0)
+        student = baker.make(StudentBreak._meta.get_field('student').related_model)
+        view = self.make_view(start_date=rollouts[0].class_date.isoformat(),
+                              end_date=rollouts[-1].class_date.isoformat(),
+                              student_id=student.id, reason='Holiday')
+
+        view.break_process(rollouts[0])
+
+        self.assertFalse(StudentBreak.objects.filter(student=student).exists())
+
+
+class FakeCalendar(object):
+    """
+    Stand-in for prepare_data_and_update_event and delete_gcalendar_event.
+    Records the calls, takes latency seconds per call and fails for the events in failing
+    """
+
+    def __init__(self, latency=0.0, failing=()):
+        self.latency = latency
+        self.failing = set(failing)
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def update_event(self, event_id, calendar_id, **data):
+        self.call(u'update', event_id, calendar_id, data)
+
+    def delete_event(self, calendar_id, event_id):
+        self.call(u'delete', event_id, calendar_id, {})
+
+    def call(self, action, event_id, calendar_id, data):
+        time.sleep(self.latency)
+
+        with self._lock:
+            self.calls.append((action, event_id, calendar_id, data))
+
+        if event_id in self.failing:
+            raise RuntimeError(u'Calendar error for {}'.format(event_id))
+
+
+class GoogleCalendarSyncTest(SimpleTestCase):
+    """
+    change_gc_events runs the calls on GC_SYNC_POOL, awaits all of them and reports each failure
+    """
+
+    def test_calls_run_concurrently_and_all_finish(self):
+        calendar = FakeCalendar(latency=0.1)
+        calls = [(i, partial(calendar.delete_event, u'calendar', u'event-{}'.format(i))) for i in range(16)]
+
+        started = time.monotonic()
+        failures = change_gc_events(calls)
+        elapsed = time.monotonic() - started
+
+        self.assertEqual(failures, [])
+        self.assertEqual(len(calendar.calls), 16)
+        # two rounds of GC_SYNC_WORKERS calls instead of 16 sequential ones
+        self.assertLess(elapsed, 16 * 0.1 / 2)
+
+    def test_failures_are_reported_per_event(self):
+        calendar = FakeCalendar(failing={u'event-3', u'event-7'})
+        calls = [(i, partial(calendar.update_event, u'event-{}'.format(i), u'calendar', event_name=u'Class'))
+                 for i in range(10)]
+
+        failures = change_gc_events(calls)
+
+        self.assertEqual(sorted(key for key, error in failures), [3, 7])
+        self.assertEqual(len(calendar.calls), 10)
@@ -0,0 +1,415 @@
+def install_paginator_sql():
+    """
+    Run every CREATE statement of the CustomPaginator docstring,
+    so the tests use the SQL the databases are told to install.
+    The ordered functions and the listing tables come from the products migrations
+    """
+    statements = [block.strip() for block in textwrap.dedent(CustomPaginator.__doc__).split('\n\n')
+                  if block.strip().startswith('CREATE')]
+
+    with connection.cursor() as cursor:
+        for statement in statements:
+            cursor.execute(statement)
+
+
+def use_ordered_functions(installed):
+    CustomPaginator._ordered_functions = installed
+    CustomPaginator._ordered_functions_checked = time.monotonic()
+
+
+def percentiles(durations):
+    """
+    p50 and p95 of the durations in ms
+    """
+    return statistics.median(durations) * 1000, statistics.quantiles(durations, n=20)[18] * 1000
+
+
+class CustomPaginatorSQLTest(TestCase):
+    """
+    Page contents and query counts of CustomPaginator on a seeded products_product.
+    The query counts are the regression budget of each mode
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        install_paginator_sql()
+
+        products = baker.make(Product, is_active=True, _quantity=45)
+        order_ids = [p.id for p in products]
+        random.Random(7).shuffle(order_ids)
+
+        # every third curated product is inactive
+        inactive_ids = order_ids[::3]
+        Product.objects.filter(id__in=inactive_ids).update(is_active=False)
+
+        cls.expected_ids = [i for i in order_ids if i not in inactive_ids]
+        cls.search_page = baker.make(SearchPage, slug='tours', type='tour',
+                                     _ordered_m2m_ordering=str(order_ids))
+        materialize_listing(cls.search_page)
+
+    def setUp(self):
+        cache.clear()
+        # installed by the products migrations
+        use_ordered_functions(True)
+
+    def paginator(self, **kwargs):
+        return CustomPaginator([], 10, slug='tours', type_product='tour', paginate_by=10, **kwargs)
+
+    def expected_page(self, number):
+        return self.expected_ids[(number - 1) * 10:number * 10]
+
+    def test_pages_follow_curated_order(self):
+        modes = [
+            {},
+            {'seek': True},
+            {'materialized': True},
+            {'fields': ['id', 'is_active']},
+            {'read_ahead': 2},
+        ]
+
+        for ordered_functions in (False, True):
+            for mode in modes:
+                with self.subTest(ordered_functions=ordered_functions, **mode):
+                    cache.clear()
+                    use_ordered_functions(ordered_functions)
+                    paginator = self.paginator(**mode)
+
+                    self.assertEqual(paginator.count, len(self.expected_ids))
+
+                    for number in paginator.page_range:
+                        ids = [p.id for p in paginator.page(number).object_list]
+                        self.assertEqual(ids, self.expected_page(number))
+
+    def test_fields_take_attnames_in_every_mode(self):
+        # foreign keys are projected by attname, their column can differ (db_column)
+        fields = [f.attname for f in Product._meta.concrete_fields]
+
+        for mode in ({}, {'seek': True}, {'materialized': True}):
+            with self.subTest(**mode):
+                cache.clear()
+                paginator = self.paginator(fields=fields, **mode)
+                rows = paginator.page(1).object_list
+
+                self.assertEqual([row.id for row in rows], self.expected_page(1))
+                self.assertEqual(list(rows[0]._fields), [u'id'] + [f for f in fields if f != u'id'])
+
+    def test_unknown_fields_are_rejected(self):
+        with self.assertRaises(ValueError):
+            self.paginator(fields=['id', 'missing'])
+
+    def test_cold_page_queries(self):
+        # SearchPage, page rows with the count
+        with self.assertNumQueries(2):
+            self.paginator().page(1)
+
+    def test_warm_page_queries(self):
+        self.paginator().page(1)
+
+        # get_ordered_page only, the count and the order ids are cached
+        with self.assertNumQueries(1):
+            self.paginator().page(3)
+
+    def test_seek_active_ids_are_cached(self):
+        self.paginator(seek=True).page(1)
+
+        with self.assertNumQueries(1):
+            page = self.paginator(seek=True).page(3)
+
+        self.assertEqual([p.id for p in page.object_list], self.expected_page(3))
+
+    def test_read_ahead_pages_skip_database(self):
+        self.paginator(read_ahead=2).page(1)
+
+        with self.assertNumQueries(0):
+            page = self.paginator(read_ahead=2).page(2)
+
+        self.assertEqual([p.id for p in page.object_list], self.expected_page(2))
+
+    def test_renamed_page_drops_cached_order_ids(self):
+        self.paginator().page(1)
+
+        self.search_page.slug = 'renamed-tours'
+        self.search_page.save()
+
+        with self.assertRaises(SearchPage.DoesNotExist):
+            self.paginator()
+
+    def test_count_follows_product_activity(self):
+        paginator = self.paginator()
+        paginator.page(1)
+
+        product = Product.objects.get(id=self.expected_ids[0])
+        product.is_active = False
+        product.save()
+
+        self.assertEqual(self.paginator().count, len(self.expected_ids) - 1)
+        self.assertEqual([p.id for p in self.paginator(materialized=True).page(1).object_list],
+                         self.expected_ids[1:11])
+
+    def test_product_save_does_not_look_up_activity(self):
+        product = Product.objects.get(id=self.expected_ids[0])
+
+        # the UPDATE only, is_active was loaded with the product
+        with self.assertNumQueries(1):
+            product.save()
+
+        self.assertEqual(self.paginator().count, len(self.expected_ids))
+
+
+class CustomPaginatorSeekDepthTest(TestCase):
+    """
+    Seek pages of a 10k products listing cost the same at any depth
+    """
+    size = 10000
+
+    @classmethod
+    def setUpTestData(cls):
+        baker.make(Product, is_active=True, _quantity=cls.size, _bulk_create=True)
+
+        order_ids = list(Product.objects.values_list('id', flat=True))
+        random.Random(7).shuffle(order_ids)
+
+        cls.order_ids = order_ids
+        baker.make(SearchPage, slug='all-tours', type='tour', _ordered_m2m_ordering=str(order_ids))
+
+    def setUp(self):
+        cache.clear()
+
+    def paginator(self):
+        return CustomPaginator([], 10, slug='all-tours', type_product='tour', paginate_by=10, seek=True)
+
+    def test_page_queries_do_not_depend_on_depth(self):
+        self.paginator().page(1)
+
+        for number in (1, self.size // 20, self.size // 10):
+            with self.subTest(number=number):
+                with CaptureQueriesContext(connection) as queries:
+                    page = self.paginator().page(number)
+
+                # the page rows only, looked up by the ids of the page
+                self.assertEqual(len(queries), 1)
+                self.assertEqual([p.id for p in page.object_list],
+                                 self.order_ids[(number - 1) * 10:number * 10])
+
+
+# the benchmarks seed tens of thousands of products, they run on request only
+RUN_BENCHMARKS = os.environ.get('PAGINATOR_BENCHMARK')
+SKIP_BENCHMARK_REASON = u'PAGINATOR_BENCHMARK=1 manage.py test --tag benchmark runs the paginator benchmarks'
+
+
+class PaginatorBenchmarkMixin(object):
+    """
+    Timing of paginator calls, reported on stdout once the class has run.
+    The numbers are printed, not gated
+    """
+    runs = 20
+    # report the peak Python memory of the measured call
+    trace_memory = False
+
+    @classmethod
+    def seed_products(cls, count):
+        """
+        Active products in a shuffled order
+        :param count:
+        :return: list of ids
+        """
+        baker.make(Product, is_active=True, _quantity=count, _bulk_create=True)
+        ids = list(Product.objects.order_by('id').values_list('id', flat=True))
+        random.Random(7).shuffle(ids)
+
+        return ids
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.report = []
+
+    @classmethod
+    def tearDownClass(cls):
+        sys.stdout.write('\n' + '\n'.join(cls.report) + '\n')
+        super().tearDownClass()
+
+    def measure(self, label, setup, call):
+        """
+        Time call on a fresh target and record its percentiles and query count
+        :param label:
+        :param setup: callable building the target, not timed. The cache is cleared before it
+        :param call: callable taking the target, runs the measured call
+        :return:
+        """
+        durations = []
+
+        for _ in range(self.runs):
+            cache.clear()
+            target = setup()
+
+            with CaptureQueriesContext(connection) as queries:
+                started = time.perf_counter()
+                call(target)
+                durations.append(time.perf_counter() - started)
+
+        p50, p95 = percentiles(durations)
+        line = u'{}: p50 {:.2f} ms, p95 {:.2f} ms, {} queries'.format(label, p50, p95, len(queries))
+
+        if self.trace_memory:
+            # one more run under tracemalloc, it slows the timed runs down
+            cache.clear()
+            target = setup()
+            tracemalloc.start()
+
+            try:
+                call(target)
+                line += u', peak {:.1f} KiB'.format(tracemalloc.get_traced_memory()[1] / 1024)
+            finally:
+                tracemalloc.stop()
+
+        self.report.append(line)
+
+
+@tag('benchmark')
+@skipUnless(RUN_BENCHMARKS, SKIP_BENCHMARK_REASON)
+class CustomPaginatorLatencyTest(PaginatorBenchmarkMixin, TestCase):
+    """
+    p50/p95 latency, query count and peak memory of page() and count by mode,
+    list size, page depth and active ratio.
+    The fields modes load projected rows instead of full Product instances.
+    Pages are measured with a known count, the path of every later request of a listing,
+    and cold, when the rows and the count come from one PAGE_WITH_COUNT_SQL query
+    """
+    sizes = (1000, 10000)
+    trace_memory = True
+    projected_fields = ['id', 'is_active']
+
+    @classmethod
+    def setUpTestData(cls):
+        install_paginator_sql()
+
+        ids = cls.seed_products(max(cls.sizes) * 2)
+
+        # every other product is inactive, the half active lists take them in
+        Product.objects.filter(id__in=ids[1::2]).update(is_active=False)
+
+        cls.listings = []
+
+        for size in cls.sizes:
+            for active_ratio, order_ids in ((1.0, ids[::2][:size]), (0.5, ids[:size])):
+                slug = 'bench-{}-{}'.format(size, int(active_ratio * 100))
+                materialize_listing(baker.make(SearchPage, slug=slug, type='tour',
+                                               _ordered_m2m_ordering=str(order_ids)))
+                cls.listings.append((slug, size, active_ratio))
+
+    def test_page_and_count_latency(self):
+        modes = (
+            (u'idx', False, {}),
+            (u'ordered', True, {}),
+            (u'seek', True, {'seek': True}),
+            (u'materialized', True, {'materialized': True}),
+            (u'ordered fields', True, {'fields': self.projected_fields}),
+            (u'seek fields', True, {'seek': True, 'fields': self.projected_fields}),
+        )
+
+        for slug, size, active_ratio in self.listings:
+            for name, ordered_functions, mode in modes:
+                use_ordered_functions(ordered_functions)
+
+                def paginator(mode=mode, slug=slug):
+                    return CustomPaginator([], 10, slug=slug, type_product='tour', paginate_by=10, **mode)
+
+                count = paginator().count
+
+                def counted_paginator(paginator=paginator, count=count):
+                    # page() skips the page-with-count query and runs get_page or get_ordered_page
+                    counted = paginator()
+                    counted._count = count
+                    return counted
+
+                last_page = paginator().num_pages
+                label = u'{} size={} active={}'.format(name, size, active_ratio)
+
+                for number in (1, last_page // 2 or 1, last_page):
+                    self.measure(u'{} page={}'.format(label, number), counted_paginator,
+                                 lambda target, number=number: target.page(number))
+
+                self.measure(u'{} cold page=1'.format(label), paginator, lambda target: target.page(1))
+                self.measure(u'{} count'.format(label), paginator, lambda target: target.count)
+
+        self.assertTrue(self.report)
+
+
+@tag('benchmark')
+@skipUnless(RUN_BENCHMARKS, SKIP_BENCHMARK_REASON)
+class OrderedPageFunctionsBenchmarkTest(PaginatorBenchmarkMixin, TestCase):
+    """
+    get_page (idx() ordering) against get_ordered_page (array position ordering)
+    on the last page of 1k, 10k and 50k id arrays
+    """
+    sizes = (1000, 10000, 50000)
+    # get_page is O(n^2), a 50k array takes seconds per run
+    runs = 5
+
+    @classmethod
+    def setUpTestData(cls):
+        install_paginator_sql()
+
+        cls.order_ids = cls.seed_products(max(cls.sizes))
+
+    def page_ids(self, function, order_ids):
+        cursor = connection.cursor()
+        cursor.execute('SELECT id FROM {}(%s, %s, %s)'.format(function), [order_ids, 10, len(order_ids) - 10])
+        return [row[0] for row in cursor.fetchall()]
+
+    def test_ordered_page_is_faster(self):
+        for size in self.sizes:
+            order_ids = self.order_ids[:size]
+
+            for function in ('get_page', 'get_ordered_page'):
+                self.assertEqual(self.page_ids(function, order_ids), order_ids[-10:])
+
+                self.measure(u'{} size={}'.format(function, size), lambda: None,
+                             lambda target, function=function: self.page_ids(function, order_ids))
+
+
+@tag('benchmark')
+@skipUnless(RUN_BENCHMARKS, SKIP_BENCHMARK_REASON)
+class SeekPaginationBenchmarkTest(PaginatorBenchmarkMixin, TestCase):
+    """
+    Seek pages against OFFSET pages (get_ordered_page) on 10k and 100k listings,
+    first, middle and last page, both with the count and the active ids cached
+    """
+    sizes = (10000, 100000)
+    runs = 10
+
+    @classmethod
+    def setUpTestData(cls):
+        install_paginator_sql()
+
+        ids = cls.seed_products(max(cls.sizes))
+
+        for size in cls.sizes:
+            baker.make(SearchPage, slug='seek-{}'.format(size), type='tour', _ordered_m2m_ordering=str(ids[:size]))
+
+    def test_seek_against_offset(self):
+        use_ordered_functions(True)
+
+        for size in self.sizes:
+            last_pages = {}
+
+            for name, mode in ((u'offset', {}), (u'seek', {'seek': True})):
+                def paginator(mode=mode, size=size):
+                    return CustomPaginator([], 10, slug='seek-{}'.format(size), type_product='tour',
+                                           paginate_by=10, **mode)
+
+                def warm_paginator(paginator=paginator):
+                    # a later request of the listing, the count and the seek active ids are cached
+                    paginator().page(1)
+                    return paginator()
+
+                last_page = paginator().num_pages
+
+                for number in (1, last_page // 2, last_page):
+                    self.measure(u'{} size={} page={}'.format(name, size, number), warm_paginator,
+                                 lambda target, number=number: target.page(number))
+
+                last_pages[name] = [p.id for p in paginator().page(last_page).object_list]
+
+            self.assertEqual(last_pages[u'seek'], last_pages[u'offset'])
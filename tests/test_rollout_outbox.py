@@ -0,0 +1,82 @@
+class RolloutOutboxDrainTest(TestCase):
+    """
+    Claiming, delivery, coalescing, backoff and dead letters of drain_rollout_outbox,
+    the google calendar helpers are replaced by a FakeCalendar
+    """
+
+    def setUp(self):
+        self.calendar = FakeCalendar()
+        self.rollout = baker.make(ClassRollout, class_status='scheduled', class_date=date(2026, 1, 5),
+                                  start_time=time(10), end_time=time(11))
+
+        patcher = mock.patch.dict(drain_rollout_outbox.__globals__, {
+            'prepare_data_and_update_event': self.calendar.update_event,
+            'delete_gcalendar_event': self.calendar.delete_event
+        })
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def enqueue(self, kind, **fields):
+        return RolloutOutbox.objects.create(kind=kind, object_id=self.rollout.pk, **fields)
+
+    def test_claimed_batch_is_hidden_for_the_lease(self):
+        messages = [self.enqueue(RolloutOutbox.UPDATE_GC_EVENT) for _ in range(3)]
+
+        started = timezone.now()
+        batch = claim_outbox_batch(2)
+
+        self.assertEqual([message.id for message in batch], [message.id for message in messages[:2]])
+        self.assertEqual([message.id for message in claim_outbox_batch(2)], [messages[2].id])
+        self.assertEqual(claim_outbox_batch(2), [])
+
+        for message in RolloutOutbox.objects.filter(id__in=[message.id for message in batch]):
+            self.assertGreaterEqual(message.available_at, started + timedelta(seconds=OUTBOX_LEASE))
+
+    def test_delivered_messages_are_deleted(self):
+        self.enqueue(RolloutOutbox.UPDATE_GC_EVENT)
+
+        with mock.patch.object(ClassRollout, 'send_change_event_notification_email') as send_email:
+            self.enqueue(RolloutOutbox.CHANGE_EMAIL, payload={'count': 1, 'user': 'Manager'})
+            self.assertEqual(drain_rollout_outbox(), 2)
+
+        self.assertEqual([call[:2] for call in self.calendar.calls], [(u'update', self.rollout.gc_event_id)])
+        self.assertEqual(send_email.call_count, 1)
+        self.assertFalse(RolloutOutbox.objects.exists())
+
+    def test_superseded_calendar_messages_are_coalesced(self):
+        self.enqueue(RolloutOutbox.UPDATE_GC_EVENT)
+        self.enqueue(RolloutOutbox.UPDATE_GC_EVENT)
+        self.enqueue(RolloutOutbox.DELETE_GC_EVENT)
+
+        self.assertEqual(drain_rollout_outbox(), 3)
+
+        # the calls read the current state, the last message of the event stands for all of them
+        self.assertEqual([call[:2] for call in self.calendar.calls], [(u'delete', self.rollout.gc_event_id)])
+        self.assertFalse(RolloutOutbox.objects.exists())
+
+    def test_failed_messages_back_off(self):
+        self.calendar.failing.add(self.rollout.gc_event_id)
+        message = self.enqueue(RolloutOutbox.UPDATE_GC_EVENT)
+
+        for attempts in (1, 2):
+            RolloutOutbox.objects.filter(id=message.id).update(available_at=timezone.now())
+            started = timezone.now()
+            drain_rollout_outbox()
+
+            message.refresh_from_db()
+            self.assertEqual(message.attempts, attempts)
+            self.assertIn(u'Calendar error', message.last_error)
+            self.assertGreaterEqual(message.available_at,
+                                    started + timedelta(seconds=OUTBOX_BACKOFF * 2 ** (attempts - 1)))
+
+    def test_exhausted_messages_are_kept_as_dead_letters(self):
+        self.calendar.failing.add(self.rollout.gc_event_id)
+        message = self.enqueue(RolloutOutbox.UPDATE_GC_EVENT, attempts=OUTBOX_MAX_ATTEMPTS - 1)
+
+        drain_rollout_outbox()
+        RolloutOutbox.objects.filter(id=message.id).update(available_at=timezone.now())
+
+        message.refresh_from_db()
+        self.assertEqual(message.attempts, OUTBOX_MAX_ATTEMPTS)
+        self.assertEqual(claim_outbox_batch(OUTBOX_BATCH_SIZE), [])
+        self.assertTrue(RolloutOutbox.objects.filter(id=message.id).exists())
@@ -0,0 +1,137 @@
+class ShowcasePricingQueriesTest(TestCase):
+    """
+    The showcase pricing queries don't depend on the number of products on the page
+    """
+
+    def make_products(self, count):
+        products = baker.make(Product, _quantity=count)
+
+        for product in products:
+            for base_rate in (Decimal('120.00'), Decimal('80.00')):
+                option = baker.make(ProductOption, is_pack_or_lux=base_rate < 100,
+                                    **{OPTION_PRODUCT_FIELD.name: product})
+                baker.make(ProductPrice, base_rate=base_rate, **{PRICE_OPTION_FIELD.name: option})
+
+        return Product.objects.filter(pk__in=[p.pk for p in products])
+
+    def make_view(self):
+        view = ShowcaseView()
+        view.shared_pricing = None
+        return view
+
+    def count_pricing_queries(self, products):
+        with CaptureQueriesContext(connection) as queries:
+            self.make_view().with_showable_prices(products)
+
+        return len(queries)
+
+    def test_unstored_pricing_queries_are_constant(self):
+        # products with their stored pricing, the batched fallback for the missing ones
+        self.assertEqual(self.count_pricing_queries(self.make_products(2)), 2)
+        self.assertEqual(self.count_pricing_queries(self.make_products(20)), 2)
+
+    def test_stored_pricing_queries_are_constant(self):
+        for count in (2, 20):
+            with self.subTest(count=count):
+                products = self.make_products(count)
+                recompute_showable_prices([p.pk for p in products])
+
+                self.assertEqual(self.count_pricing_queries(products), 1)
+
+    def test_showable_price_is_the_lowest_option(self):
+        products = self.make_products(3)
+        recompute_showable_prices([products[0].pk])
+
+        for product in self.make_view().with_showable_prices(products):
+            self.assertEqual(product.showable_price, Decimal('80.00'))
+            self.assertTrue(product.is_lux)
+
+    def test_showcase_data_queries_are_constant(self):
+        counts = []
+
+        for count in (2, 20):
+            showcase_page = baker.make(ShowcasePage, slug='showcase-{}'.format(count), is_active=True)
+            showcase_page.products.set(self.make_products(count))
+            showcase_page.similar_tours.set(self.make_products(count))
+
+            with CaptureQueriesContext(connection) as queries:
+                self.make_view().build_showcase_data(showcase_page.slug)
+
+            counts.append(len(queries))
+
+        self.assertEqual(counts[0], counts[1])
+
+    def test_pricing_is_recomputed_once_per_transaction(self):
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            products = self.make_products(20)
+
+        self.assertEqual(len([c for c in callbacks if isinstance(c, ShowablePriceRecompute)]), 1)
+        self.assertEqual(ProductShowablePrice.objects.filter(product__in=products,
+                                                             showable_price=Decimal('80.00')).count(), 20)
+
+
+SHOWCASE_TEST_TEMPLATES = [{
+    'BACKEND': 'django.template.backends.django.DjangoTemplates',
+    'OPTIONS': {
+        'loaders': [('django.template.loaders.locmem.Loader', {
+            'showcase/showcase.html': u'<h1>{{ showcase_page.slug }}</h1>{{ agents_block }}',
+            'showcase/agents.html': u'{% for agent in agents %}<p class="agent">{{ agent.pk }}</p>{% endfor %}',
+        })],
+    },
+}]
+
+
+@override_settings(TEMPLATES=SHOWCASE_TEST_TEMPLATES)
+class ShowcaseRenderTest(TestCase):
+    """
+    The agents block is spliced into the rendered, cached page
+    """
+
+    def setUp(self):
+        cache.clear()
+
+        self.agent = baker.make(TeamMember)
+        baker.make(TeamGroup, is_agent=True).members.add(self.agent)
+        baker.make(ShowcasePage, slug='tours', is_active=True)
+
+    def render(self, view_class):
+        request = RequestFactory().get('/showcase/tours/')
+        request.user = AnonymousUser()
+        view = view_class.as_view()
+
+        if view_class.view_is_async:
+            response = async_to_sync(view)(request, slug='tours')
+        else:
+            response = view(request, slug='tours')
+
+        return response.content.decode('utf-8')
+
+    def test_agents_are_rendered(self):
+        for view_class in (ShowcaseView, AsyncShowcaseView):
+            # built, then served from the page cache
+            for cached in (False, True):
+                with self.subTest(view=view_class.__name__, cached=cached):
+                    content = self.render(view_class)
+
+                    self.assertIn(u'<p class="agent">{}</p>'.format(self.agent.pk), content)
+                    self.assertNotIn(u'showcase-agents', content)
+
+
+class AgentIdsCacheTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.group = baker.make(TeamGroup, is_agent=True)
+
+    def test_agent_ids_are_dropped_after_commit(self):
+        agent = baker.make(TeamMember)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.group.members.add(agent)
+            get_agent_ids()
+
+            # still cached until the membership is committed
+            self.assertIsNotNone(cache.get(AGENT_IDS_CACHE_KEY))
+
+        self.assertIsNone(cache.get(AGENT_IDS_CACHE_KEY))
+        self.assertEqual(get_agent_ids(), [agent.pk])